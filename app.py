@@ -8,20 +8,71 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
+import os
 import time
 import json
+import re
+import sqlite3
+import hashlib
+import threading
+import queue
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from concurrent.futures import TimeoutError as FutureTimeoutError
 import requests
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional
 import random
+import logging
+import math
+import textwrap
+import zlib
+import atexit
+import bisect
+import hmac
+import secrets
+import heapq
+import unicodedata
+from collections import Counter, defaultdict, deque
+from collections.abc import Mapping
+from types import MappingProxyType
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+try:
+    import yaml  # optional: only needed for .yaml content packs
+except ImportError:
+    yaml = None
+
+logger = logging.getLogger("his220")
+if not logger.handlers:
+    # Usage lines (tokens, prompt-cache reads/writes) go to the server log
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(levelname)s %(message)s"))
+    logger.addHandler(_log_handler)
+    logger.setLevel(os.environ.get("HIS220_LOG_LEVEL", "INFO"))
 
 # 🔐 SECURE API KEY HANDLING
-def get_api_key():
-    """Get API key from secrets or sidebar input"""
+def get_setting(name: str, default=None):
+    """Get a tuning setting from secrets, falling back to environment variables"""
     try:
-        return st.secrets["ANTHROPIC_API_KEY"]
+        return st.secrets[name]
     except (KeyError, FileNotFoundError):
-        return st.sidebar.text_input("🔑 Anthropic API Key (for testing)", type="password")
+        return os.environ.get(name, default)
+
+def get_api_key():
+    """Get API key from secrets, the environment, or sidebar input"""
+    api_key = get_setting("ANTHROPIC_API_KEY")
+    if api_key:
+        return api_key
+    return st.session_state.get("api_key_input", "")
+
+def render_api_key_input():
+    """Sidebar key field for testing; rendered once per run so pages can call get_api_key() freely"""
+    if not get_setting("ANTHROPIC_API_KEY"):
+        st.sidebar.text_input("🔑 Anthropic API Key (for testing)", type="password", key="api_key_input")
 
 # Configure page
 st.set_page_config(
@@ -48,8 +99,10 @@ def initialize_session_state():
             'completed_experts': set()
         },
         'resident_verified': False,
-        'ai_conversations': [],
-        'api_test_result': None,
+        # Per-expert conversation store, see the 💬 section below
+        'ai_conversations': {'next_seq': 0, 'experts': {}, 'bytes': 0},
+        'pending_jobs': [],
+        'conversation_resets': {},
         'current_page': 'dashboard'
     }
     
@@ -59,560 +112,2930 @@ def initialize_session_state():
 
 initialize_session_state()
 
-# Enhanced course slides data with interactive elements
-SLIDES = [
-    {
-        "id": "welcome",
-        "title": "Welcome to Michigan History",
-        "content": """
-        # 🏛️ History of Michigan (HIS 220)
-        
-        ## Wayne County Community College District
-        **3 Credit Hours | 45 Contact Hours**
-        
-        > "From French exploration to modern innovation - discover the rich tapestry of Michigan's development and its unique role in American history."
-        
-        ### Course Focus:
-        * Historical development from French exploration to present
-        * Major political, social, and economic developments
-        * Special emphasis on southeastern Michigan and Detroit metro
-        * Michigan's unique geographical influence on development
-        """,
-        "presenter_notes": "Welcome students and introduce the comprehensive nature of this course.",
-        "background_color": "#f0f8ff",
-        "animation": "fade_in"
-    },
-    {
-        "id": "geography_influence",
-        "title": "Geography's Role in Michigan Development",
-        "content": """
-        # 🗺️ Michigan's Unique Geographic Setting
-        
-        ## The Great Lakes Advantage
-        * **Surrounded by 4 of 5 Great Lakes** - Superior, Michigan, Huron, Erie
-        * **3,000 miles of freshwater coastline** - more than any other state
-        * **Strategic location** for transportation and trade
-        
-        ## Natural Resources Shaped Development
-        * **Timber** - Fueled early logging industry
-        * **Iron ore** - Upper Peninsula mining boom
-        * **Coal** - Energy for industrial growth
-        * **Fertile soil** - Agricultural development
-        
-        ## Geographic Challenges
-        * **Two peninsulas** connected by bridge (1957)
-        * **Harsh winters** influenced settlement patterns
-        * **Water transportation** crucial before railroads
-        """,
-        "presenter_notes": "Emphasize how geography directly influenced every aspect of Michigan's development.",
-        "interactive": True,
-        "discussion_prompt": "How do you think Michigan's development would have been different if it weren't surrounded by the Great Lakes?",
-        "background_color": "#e6f3ff",
-        "map_data": {
-            "great_lakes": ["Superior", "Michigan", "Huron", "Erie"],
-            "resources": ["Timber", "Iron ore", "Coal", "Fertile soil"]
+# 📦 COURSE CONTENT PACKS
+# Slides, quizzes, expert profiles and resources live in content/ as JSON (or YAML
+# when PyYAML is installed). Units are parsed on first use, frozen and shared by
+# every session, and re-read when their file changes on disk.
+CONTENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "content")
+CONTENT_EXTENSIONS = (".json", ".yaml", ".yml")
+CONTENT_FOLDERS = ("slides", "quizzes")
+UNIT_ORDER_PREFIX = re.compile(r"^\d+[-_]")
+
+class ContentError(ValueError):
+    """A content pack file that cannot be parsed or does not have the expected shape"""
+
+def freeze_content(value):
+    """Read-only copy of parsed content: dicts become mapping proxies, lists become tuples"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze_content(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze_content(item) for item in value)
+    return value
+
+def require_fields(unit: str, where: str, entry, fields: Dict[str, type]) -> None:
+    """Raise ContentError unless entry is a mapping with each field of the given type"""
+    if not isinstance(entry, dict):
+        raise ContentError(f"{unit}: {where} must be an object")
+    for field, kind in fields.items():
+        if not isinstance(entry.get(field), kind):
+            raise ContentError(f"{unit}: {where} needs a '{field}' of type {kind.__name__}")
+
+def check_optional_fields(unit: str, where: str, entry: dict, fields: Dict[str, type]) -> None:
+    """Raise ContentError if any of these fields is present with the wrong type"""
+    for field, kind in fields.items():
+        if field in entry and not isinstance(entry[field], kind):
+            raise ContentError(f"{unit}: {where} has a '{field}' that is not of type {kind.__name__}")
+
+def validate_slides(unit: str, data) -> None:
+    """A slides unit is a list of slides in presentation order"""
+    if not isinstance(data, list):
+        raise ContentError(f"{unit}: expected a list of slides")
+    for i, slide in enumerate(data):
+        where = f"slide {i + 1}"
+        require_fields(unit, where, slide, {"id": str, "title": str, "content": str})
+        # Rendering and search read these directly, so a bad value must fail here, not mid-page
+        check_optional_fields(unit, where, slide, {
+            "presenter_notes": str, "background_color": str, "timeline": dict,
+            "map_data": dict, "interactive": bool, "discussion_prompt": str
+        })
+        if any(not isinstance(event, str) for event in slide.get("timeline", {}).values()):
+            raise ContentError(f"{unit}: {where} has a timeline event that is not text")
+        if "map_data" in slide:
+            require_fields(unit, f"{where} map_data", slide["map_data"],
+                           {"great_lakes": list, "resources": list})
+
+def validate_quiz(unit: str, data) -> None:
+    """A quiz unit has a title and multiple-choice questions with an in-range answer"""
+    require_fields(unit, "quiz", data, {"title": str, "questions": list})
+    for i, question in enumerate(data["questions"]):
+        where = f"question {i + 1}"
+        require_fields(unit, where, question,
+                       {"question": str, "options": list, "correct": int, "explanation": str})
+        if not 0 <= question["correct"] < len(question["options"]):
+            raise ContentError(f"{unit}: {where} marks a missing option as correct")
+
+def validate_experts(unit: str, data) -> None:
+    """The experts unit maps an expert key to the profile used in their system prompt"""
+    if not isinstance(data, dict) or not data:
+        raise ContentError(f"{unit}: expected an object of expert profiles")
+    for key, profile in data.items():
+        require_fields(unit, key, profile, {
+            "name": str, "title": str, "expertise": str, "background": str,
+            "resident_focus": str, "key_areas": list, "personality": str
+        })
+
+def validate_resources(unit: str, data) -> None:
+    """The resources unit maps a section name to a list of links"""
+    if not isinstance(data, dict):
+        raise ContentError(f"{unit}: expected an object of resource sections")
+    for section, links in data.items():
+        if not isinstance(links, list):
+            raise ContentError(f"{unit}: section '{section}' must be a list")
+        for i, link in enumerate(links):
+            require_fields(unit, f"{section} {i + 1}", link, {"title": str, "url": str, "description": str})
+
+CONTENT_VALIDATORS = {
+    "slides": validate_slides,
+    "quizzes": validate_quiz,
+    "experts": validate_experts,
+    "resources": validate_resources
+}
+
+class ContentPack:
+    """Lazily parsed, validated and frozen content units with mtime-based hot reload.
+    
+    A unit is one file named by its path under the content directory without the
+    extension, e.g. "experts" or "quizzes/01-michigan_basics". Files are stat'ed
+    at most once per check_interval; a file that fails to parse after an edit
+    keeps serving its last good version.
+    """
+
+    def __init__(self, root: str, check_interval: float):
+        self.root = root
+        self.check_interval = check_interval
+        self._units = {}
+        self._folders = {}
+        self._collected = {}
+        self._lock = threading.Lock()
+        self._stats = {'loads': 0, 'reloads': 0, 'errors': 0}
+
+    def _find(self, name: str) -> Optional[str]:
+        for extension in CONTENT_EXTENSIONS:
+            path = os.path.join(self.root, name + extension)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def _parse(self, name: str, path: str, raw: bytes):
+        if path.endswith(".json"):
+            loader = json.loads
+        elif yaml is None:
+            raise ContentError(f"{name}: install PyYAML to load {os.path.basename(path)}")
+        else:
+            loader = yaml.safe_load
+        try:
+            data = loader(raw)
+        except (ValueError, getattr(yaml, "YAMLError", ValueError)) as e:
+            raise ContentError(f"{name}: {e}") from e
+        CONTENT_VALIDATORS[name.split("/", 1)[0]](name, data)
+        return freeze_content(data)
+
+    def _refresh(self, name: str) -> dict:
+        """Current entry for a unit, (re)parsing it if its file changed; lock held"""
+        now = time.monotonic()
+        entry = self._units.get(name)
+        if entry and now - entry['checked'] < self.check_interval:
+            return entry
+        path = self._find(name)
+        if path is None:
+            if entry:
+                # Deleted while the server runs: keep the last version rather than break pages
+                entry['checked'] = now
+                return entry
+            raise ContentError(f"{name}: no {'/'.join(CONTENT_EXTENSIONS)} file under {self.root}")
+        stat = os.stat(path)
+        signature = (path, stat.st_mtime_ns, stat.st_size)
+        if entry and entry['signature'] == signature:
+            entry['checked'] = now
+            return entry
+        with open(path, "rb") as f:
+            raw = f.read()
+        try:
+            data = self._parse(name, path, raw)
+        except ContentError as e:
+            if entry is None:
+                raise
+            # Remember the broken file so it is reported once, not on every check
+            self._stats['errors'] += 1
+            logger.error("content reload failed, keeping the previous version: %s", e)
+            entry['signature'] = signature
+            entry['checked'] = now
+            return entry
+        self._stats['reloads' if entry else 'loads'] += 1
+        entry = {
+            'data': data,
+            'digest': hashlib.sha1(raw).hexdigest()[:16],
+            'signature': signature,
+            'checked': now
         }
-    },
-    {
-        "id": "french_exploration",
-        "title": "French Exploration Era",
-        "content": """
-        # 🇫🇷 French Exploration and Settlement (1600s-1760s)
-        
-        ## Key Explorers and Missionaries
-        * **Étienne Brûlé** (1610s) - First European in Michigan
-        * **Jean Nicolet** (1634) - Explored Lake Michigan
-        * **Jacques Marquette** (1668) - Founded Sault Ste. Marie
-        * **René-Robert Cavelier, Sieur de La Salle** - Explored Great Lakes system
-        
-        ## French Influence
-        * **Fur trading** - Primary economic activity
-        * **Missionary work** - Converting Native Americans
-        * **Alliance with Native tribes** - Unlike other European powers
-        * **Place names** - Detroit, Sault Ste. Marie, Marquette
-        
-        ## Native American Relations
-        * **Ojibwe (Chippewa)** - Largest tribe in region
-        * **Ottawa** and **Potawatomi** - Part of Three Fires Confederacy
-        * **Trade partnerships** - Europeans dependent on Native knowledge
-        """,
-        "presenter_notes": "Emphasize the cooperative nature of early French-Native relations.",
-        "background_color": "#fff8e7",
-        "timeline": {
-            "1610s": "Étienne Brûlé arrives",
-            "1634": "Jean Nicolet explores",
-            "1668": "Jacques Marquette founds Sault Ste. Marie",
-            "1701": "Detroit founded"
+        self._units[name] = entry
+        return entry
+
+    def unit(self, name: str):
+        """Frozen data for one unit, loaded on first access"""
+        with self._lock:
+            return self._refresh(name)['data']
+
+    def _listing(self, folder: str) -> List[str]:
+        """Unit names in a folder, rescanned at most once per check_interval; lock held"""
+        now = time.monotonic()
+        listing = self._folders.get(folder)
+        if listing is None or now - listing[0] >= self.check_interval:
+            try:
+                files = sorted(os.listdir(os.path.join(self.root, folder)))
+            except FileNotFoundError:
+                files = []
+            names = list(dict.fromkeys(
+                f"{folder}/{os.path.splitext(file)[0]}"
+                for file in files if file.endswith(CONTENT_EXTENSIONS)
+            ))
+            listing = (now, names)
+            self._folders[folder] = listing
+        return listing[1]
+
+    def units(self, folder: str) -> List[str]:
+        """Unit names in a folder, in file name order"""
+        with self._lock:
+            return list(self._listing(folder))
+
+    def version(self, name: str) -> str:
+        """Digest of a unit, or of every unit in a folder, for keying derived caches"""
+        with self._lock:
+            if name not in CONTENT_FOLDERS:
+                return self._refresh(name)['digest']
+            parts = [f"{unit}:{self._refresh(unit)['digest']}" for unit in self._listing(name)]
+        return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+    def collect(self, folder: str) -> tuple:
+        """Every list unit in a folder concatenated in order; rebuilt only when a unit changes"""
+        with self._lock:
+            entries = [(unit, self._refresh(unit)) for unit in self._listing(folder)]
+            version = tuple((unit, entry['digest']) for unit, entry in entries)
+            cached = self._collected.get(folder)
+            if cached is None or cached[0] != version:
+                cached = (version, tuple(item for _, entry in entries for item in entry['data']))
+                self._collected[folder] = cached
+            return cached[1]
+
+    def stats(self) -> dict:
+        """Snapshot of load counters"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['units'] = len(self._units)
+        return stats
+
+class ContentFolder(Mapping):
+    """Read-only mapping over a folder's units keyed by file name without its order prefix"""
+
+    def __init__(self, pack: ContentPack, folder: str):
+        self._pack = pack
+        self._names = {UNIT_ORDER_PREFIX.sub("", name.split("/", 1)[1]): name for name in pack.units(folder)}
+
+    def __getitem__(self, key):
+        return self._pack.unit(self._names[key])
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+@st.cache_resource(show_spinner=False)
+def get_content_pack() -> ContentPack:
+    """Process-wide content pack shared by every session"""
+    return ContentPack(
+        root=get_setting("CONTENT_DIR", CONTENT_DIR),
+        check_interval=float(get_setting("CONTENT_RELOAD_SECONDS", 2.0))
+    )
+
+def get_slides() -> tuple:
+    """The whole slide deck in presentation order"""
+    slides = get_content_pack().collect("slides")
+    ids = [slide["id"] for slide in slides]
+    if len(ids) != len(set(ids)):
+        duplicates = sorted(slide_id for slide_id, count in Counter(ids).items() if count > 1)
+        raise ContentError(f"slides: duplicate slide id(s) {', '.join(duplicates)}")
+    return slides
+
+def get_quiz_data() -> Mapping:
+    """Quizzes by id; each quiz file is parsed the first time it is opened"""
+    return ContentFolder(get_content_pack(), "quizzes")
+
+def get_experts() -> Mapping:
+    """Michigan State AI expert profiles by expert key"""
+    return get_content_pack().unit("experts")
+
+def get_resources() -> Mapping:
+    """Resource links by section"""
+    return get_content_pack().unit("resources")
+
+def content_version(name: str) -> str:
+    """Current digest of a content unit or folder"""
+    return get_content_pack().version(name)
+
+# 🌐 SHARED HTTP CLIENT
+ANTHROPIC_API_URL = "https://api.anthropic.com/v1/messages"
+ANTHROPIC_VERSION = "2023-06-01"
+
+class ConnectTimingMixin:
+    """Remember how long a connection's TCP (and TLS) setup took and how many responses it served"""
+    connect_seconds = 0.0
+    requests_served = 0
+
+    def connect(self):
+        started = time.perf_counter()
+        super().connect()
+        self.connect_seconds = time.perf_counter() - started
+        # urllib3 reconnects a dropped keep-alive socket on the same object; that is a new connection
+        self.requests_served = 0
+
+class TimedHTTPConnection(ConnectTimingMixin, HTTPConnection):
+    pass
+
+class TimedHTTPSConnection(ConnectTimingMixin, HTTPSConnection):
+    pass
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose pooled connections record their connect time"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TimedHTTPConnectionPool,
+            "https": TimedHTTPSConnectionPool
         }
-    },
-    {
-        "id": "detroit_founding",
-        "title": "The Founding of Detroit",
-        "content": """
-        # 🏙️ Detroit: The Birth of a City (1701)
+
+class AnthropicHTTPClient:
+    """Pooled, keep-alive HTTP session shared by every Anthropic API call in the process"""
+
+    def __init__(self, pool_connections: int, pool_maxsize: int,
+                 connect_timeout: float, read_timeout: float, api_url: str = ANTHROPIC_API_URL):
+        self.api_url = api_url
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.session = requests.Session()
+        # pool_block keeps the pool bounded: extra callers wait for a free
+        # connection instead of opening throwaway sockets
+        adapter = TimedHTTPAdapter(pool_connections=pool_connections,
+                                   pool_maxsize=pool_maxsize,
+                                   pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Content-Type": "application/json",
+            "anthropic-version": ANTHROPIC_VERSION,
+            "Connection": "keep-alive"
+        })
+        self.session.hooks["response"].append(self._track_connection)
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'reused': 0, 'new_connections': 0}
+
+    def _track_connection(self, response, *args, **kwargs):
+        """Record whether the response was served over an already-open connection"""
+        conn = getattr(response.raw, "_connection", None)
+        served = getattr(conn, "requests_served", 0)
+        if conn is not None:
+            conn.requests_served = served + 1
+        response.connection_reused = served > 0
+        response.connect_seconds = 0.0 if response.connection_reused else getattr(conn, "connect_seconds", 0.0)
+        with self._lock:
+            self._stats['requests'] += 1
+            if response.connection_reused:
+                self._stats['reused'] += 1
+            else:
+                self._stats['new_connections'] += 1
+        return response
+
+    def post(self, api_key: str, payload: dict, read_timeout: Optional[float] = None,
+             **kwargs) -> requests.Response:
+        """POST a Messages API payload through the shared connection pool"""
+        return self.session.post(
+            self.api_url,
+            headers={"x-api-key": api_key},
+            json=payload,
+            timeout=(self.connect_timeout, read_timeout or self.read_timeout),
+            **kwargs
+        )
+
+    def stats(self) -> dict:
+        """Snapshot of connection reuse counters"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['reuse_rate'] = stats['reused'] / stats['requests'] if stats['requests'] else 0.0
+        return stats
+
+@st.cache_resource(show_spinner=False)
+def get_http_client() -> AnthropicHTTPClient:
+    """Process-wide HTTP client, created once and reused by all sessions"""
+    return AnthropicHTTPClient(
+        pool_connections=int(get_setting("HTTP_POOL_CONNECTIONS", 4)),
+        pool_maxsize=int(get_setting("HTTP_POOL_MAXSIZE", 32)),
+        connect_timeout=float(get_setting("HTTP_CONNECT_TIMEOUT", 3.05)),
+        read_timeout=float(get_setting("HTTP_READ_TIMEOUT", 30)),
+        # Point at mock_anthropic.py for local load testing
+        api_url=get_setting("ANTHROPIC_API_URL", ANTHROPIC_API_URL)
+    )
+
+# 🚦 SHARED RATE LIMITING
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 529}
+
+class RateLimiter:
+    """Process-wide FIFO token bucket for requests/minute and tokens/minute"""
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._cond = threading.Condition()
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._waiters = deque()
+        self._stats = {'acquired': 0, 'queued': 0, 'wait_seconds': 0.0, 'pauses': 0}
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.requests_per_minute,
+                             self._requests + elapsed * self.requests_per_minute / 60)
+        self._tokens = min(self.tokens_per_minute,
+                           self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    def _delay_for(self, tokens: float) -> float:
+        """Seconds until the head of the queue could be admitted"""
+        delays = [self._paused_until - time.monotonic()]
+        if self._requests < 1:
+            delays.append((1 - self._requests) * 60 / self.requests_per_minute)
+        if self._tokens < tokens:
+            delays.append((tokens - self._tokens) * 60 / self.tokens_per_minute)
+        return max(delays)
+
+    def acquire(self, tokens: float, on_wait: Optional[Callable[[int, float], None]] = None) -> None:
+        """Block until this caller reaches the head of the queue and both buckets have room.
+
+        on_wait(position, seconds) is called whenever the caller's place in line changes,
+        and with (1, 0.0) when a caller last reported further back is let through.
+        """
+        # An oversized request must still be admissible once the bucket is full
+        tokens = min(tokens, self.tokens_per_minute)
+        waiter = object()
+        started = time.monotonic()
+        last_position = None
+        with self._cond:
+            self._waiters.append(waiter)
+            try:
+                while True:
+                    self._refill()
+                    position = self._waiters.index(waiter) + 1
+                    delay = self._delay_for(tokens) if position == 1 else 1.0
+                    if position == 1 and delay <= 0:
+                        break
+                    if on_wait and position != last_position:
+                        last_position = position
+                        # Report outside the lock so a slow UI update cannot stall other callers
+                        self._cond.release()
+                        try:
+                            on_wait(position, max(delay, 0.0))
+                        finally:
+                            self._cond.acquire()
+                        continue
+                    self._cond.wait(timeout=min(max(delay, 0.05), 1.0))
+                self._requests -= 1
+                self._tokens -= tokens
+                self._stats['acquired'] += 1
+                if last_position is not None:
+                    self._stats['queued'] += 1
+                    self._stats['wait_seconds'] += time.monotonic() - started
+            finally:
+                # Also runs when a Streamlit rerun interrupts a waiting script thread
+                self._waiters.remove(waiter)
+                self._cond.notify_all()
+        if on_wait and last_position not in (None, 1):
+            on_wait(1, 0.0)
+
+    def settle(self, estimated_tokens: float, actual_tokens: float) -> None:
+        """Return over-reserved tokens once the real usage is known"""
+        with self._cond:
+            self._tokens = min(self.tokens_per_minute,
+                               self._tokens + estimated_tokens - actual_tokens)
+            self._cond.notify_all()
+
+    def pause(self, seconds: float) -> None:
+        """Hold every caller back, e.g. after the API answered 429 with retry-after"""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._stats['pauses'] += 1
+
+    def stats(self) -> dict:
+        """Snapshot of queue depth and admission counters"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats['waiting'] = len(self._waiters)
+        return stats
+
+@st.cache_resource(show_spinner=False)
+def get_rate_limiter() -> RateLimiter:
+    """Process-wide rate limiter shared by every session"""
+    return RateLimiter(
+        requests_per_minute=float(get_setting("RATE_LIMIT_RPM", 50)),
+        tokens_per_minute=float(get_setting("RATE_LIMIT_TPM", 50000))
+    )
+
+# ⚡ CIRCUIT BREAKER
+class CircuitOpenError(Exception):
+    """Raised instead of calling the API while the circuit breaker is open"""
+
+class RequestCancelled(Exception):
+    """Raised when a hedged request's twin already answered"""
+
+class CircuitBreaker:
+    """Process-wide breaker that fails fast after repeated API outages.
+    
+    Closed: calls go through. Open: calls are refused until reset_seconds
+    pass. Half-open: one probe call is let through; success closes the
+    breaker, failure opens it again.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int, reset_seconds: float, probe_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.probe_timeout = probe_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_started = None
+        self._stats = {'opened': 0, 'rejected': 0}
+
+    def allow(self) -> bool:
+        """Whether a call may go upstream now; may claim the half-open probe"""
+        with self._lock:
+            now = time.monotonic()
+            if self._state == self.OPEN and now - self._opened_at >= self.reset_seconds:
+                self._state = self.HALF_OPEN
+                self._probe_started = None
+            if self._state == self.HALF_OPEN:
+                # A probe abandoned mid-call (e.g. by a rerun) must not wedge the breaker
+                if self._probe_started is None or now - self._probe_started > self.probe_timeout:
+                    self._probe_started = now
+                    return True
+            if self._state == self.CLOSED:
+                return True
+            self._stats['rejected'] += 1
+            return False
+
+    def is_open(self) -> bool:
+        """True while calls would be refused, without claiming a probe"""
+        with self._lock:
+            if self._state == self.OPEN:
+                return time.monotonic() - self._opened_at < self.reset_seconds
+            return (self._state == self.HALF_OPEN and self._probe_started is not None
+                    and time.monotonic() - self._probe_started <= self.probe_timeout)
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("circuit breaker closed: API recovered")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_started = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or (self._state == self.CLOSED
+                                                 and self._failures >= self.failure_threshold):
+                logger.warning("circuit breaker opened after %s consecutive failures", self._failures)
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_started = None
+                self._stats['opened'] += 1
+
+    def record_status(self, status_code: int) -> None:
+        """Server errors count against the API; anything else shows it is reachable"""
+        if status_code >= 500:
+            self.record_failure()
+        else:
+            self.record_success()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(state=self._state, failures=self._failures)
+            if self._state == self.OPEN:
+                stats['retry_in'] = max(0.0, self.reset_seconds - (time.monotonic() - self._opened_at))
+        return stats
+
+@st.cache_resource(show_spinner=False)
+def get_circuit_breaker() -> CircuitBreaker:
+    """Process-wide circuit breaker around the Anthropic API"""
+    return CircuitBreaker(
+        failure_threshold=int(get_setting("CIRCUIT_FAILURE_THRESHOLD", 5)),
+        reset_seconds=float(get_setting("CIRCUIT_RESET_SECONDS", 30)),
+        probe_timeout=float(get_setting("CIRCUIT_PROBE_TIMEOUT_SECONDS", 60))
+    )
+
+def estimate_request_tokens(data: dict) -> int:
+    """Rough token reservation: ~4 characters per input token plus the output budget"""
+    system = data.get("system", "")
+    if isinstance(system, list):
+        system = "".join(block.get("text", "") for block in system)
+    chars = len(system) + sum(len(str(m["content"])) for m in data["messages"])
+    return chars // 4 + data.get("max_tokens", 0)
+
+def retry_after_seconds(response: requests.Response) -> Optional[float]:
+    """Parse a numeric retry-after header, if present"""
+    try:
+        return float(response.headers["retry-after"])
+    except (KeyError, ValueError):
+        return None
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with jitter"""
+    base = float(get_setting("API_BACKOFF_BASE_SECONDS", 1.0))
+    cap = float(get_setting("API_BACKOFF_MAX_SECONDS", 20.0))
+    return min(cap, base * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+def send_messages_request(api_key: str, data: dict, stream: bool = False,
+                          on_wait: Optional[Callable[[int, float], None]] = None,
+                          cancelled: Optional[threading.Event] = None) -> requests.Response:
+    """Send a Messages request through the shared limiter, retrying 429/5xx with backoff"""
+    limiter = get_rate_limiter()
+    client = get_http_client()
+    breaker = get_circuit_breaker()
+    max_retries = int(get_setting("API_MAX_RETRIES", 3))
+    estimate = estimate_request_tokens(data)
+    
+    for attempt in range(max_retries + 1):
+        if cancelled is not None and cancelled.is_set():
+            raise RequestCancelled("a hedged copy of this request already answered")
+        # Checked before queueing so an outage fails fast instead of holding a place in line
+        if not breaker.allow():
+            raise CircuitOpenError("Michigan State AI is temporarily unavailable")
+        limiter.acquire(estimate, on_wait)
+        try:
+            response = client.post(api_key, data, stream=stream)
+        except requests.exceptions.ConnectionError:
+            breaker.record_failure()
+            if attempt == max_retries:
+                raise
+            delay = backoff_delay(attempt)
+        except requests.exceptions.Timeout:
+            breaker.record_failure()
+            raise
+        else:
+            breaker.record_status(response.status_code)
+            if response.status_code not in RETRYABLE_STATUS_CODES or attempt == max_retries:
+                response.token_estimate = estimate
+                response.retries = attempt
+                return response
+            # retry-after is a floor; backoff still grows if the API keeps refusing
+            delay = max(retry_after_seconds(response) or 0.0, backoff_delay(attempt))
+            if response.status_code == 429:
+                limiter.pause(delay)
+            response.close()
+        if on_wait:
+            on_wait(0, delay)
+        time.sleep(delay)
+
+class PromptCacheStats:
+    """Process-wide totals of prompt-cache reads and writes reported in response usage"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {'responses': 0, 'input_tokens': 0, 'cache_read_input_tokens': 0,
+                       'cache_creation_input_tokens': 0}
+
+    def record(self, usage: dict) -> None:
+        with self._lock:
+            self._stats['responses'] += 1
+            for field in ('input_tokens', 'cache_read_input_tokens', 'cache_creation_input_tokens'):
+                self._stats[field] += usage.get(field) or 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        prompt_tokens = (stats['input_tokens'] + stats['cache_read_input_tokens']
+                         + stats['cache_creation_input_tokens'])
+        stats['cached_share'] = stats['cache_read_input_tokens'] / prompt_tokens if prompt_tokens else 0.0
+        return stats
+
+@st.cache_resource(show_spinner=False)
+def get_prompt_cache_stats() -> PromptCacheStats:
+    """Process-wide prompt caching counters"""
+    return PromptCacheStats()
+
+def settle_usage(response_usage: dict, estimate: int) -> None:
+    """Record usage: give unused reservation back to the limiter and log prompt-cache activity"""
+    actual = response_usage.get("input_tokens", 0) + response_usage.get("output_tokens", 0)
+    if actual:
+        get_rate_limiter().settle(estimate, actual)
+    if response_usage:
+        get_prompt_cache_stats().record(response_usage)
+        logger.info(
+            "usage input=%s output=%s cache_read=%s cache_write=%s",
+            response_usage.get("input_tokens", 0), response_usage.get("output_tokens", 0),
+            response_usage.get("cache_read_input_tokens", 0),
+            response_usage.get("cache_creation_input_tokens", 0)
+        )
+
+# 📈 AI CALL METRICS
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 8.0, 13.0, 20.0, 30.0, 60.0)
+
+class Histogram:
+    """Latency histogram in the Prometheus bucket layout"""
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[tuple]:
+        """(le, count) pairs, ending with +Inf"""
+        running, pairs = 0, []
+        for le, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            running += count
+            pairs.append((le, running))
+        return pairs
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile, or None without samples"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+class AIMetrics:
+    """Process-wide per-call metrics for the AI path, aggregated by expert.
+    
+    Histograms and counters are cumulative for Prometheus; a bounded window of
+    recent calls per expert backs the p50/p95/p99 on the admin page.
+    """
+
+    HISTOGRAMS = {
+        'latency': ("his220_ai_request_seconds", "Time from asking to the full answer, including queueing and retries"),
+        'ttft': ("his220_ai_time_to_first_token_seconds", "Time from asking to the first answer text"),
+        'connect': ("his220_ai_connect_seconds", "TCP/TLS setup time for calls that opened a new connection")
+    }
+
+    def __init__(self, sample_size: int = 2048):
+        self._lock = threading.Lock()
+        self._histograms = defaultdict(Histogram)
+        self._counters = Counter()
+        self._samples = defaultdict(lambda: deque(maxlen=sample_size))
+
+    def record(self, expert: str, status: str, cache: str, latency: float,
+               ttft: Optional[float] = None, connect: Optional[float] = None,
+               input_tokens: int = 0, output_tokens: int = 0, retries: int = 0) -> None:
+        """Record one answered question.
         
-        ## Antoine de la Mothe Cadillac
-        * **Founded Detroit** on July 24, 1701
-        * **"Ville d'Étroit"** - City of the Strait
-        * **Strategic location** - Narrowest point between Lakes Erie and Huron
+        status is the HTTP status code, an exception name, or "cached";
+        cache is "hit", "miss" or "bypass" (not eligible for the shared cache).
+        """
+        with self._lock:
+            self._histograms[('latency', expert)].observe(latency)
+            if ttft is not None:
+                self._histograms[('ttft', expert)].observe(ttft)
+            if connect:
+                self._histograms[('connect', expert)].observe(connect)
+            self._counters[('requests', expert, status, cache)] += 1
+            self._counters[('retries', expert)] += retries
+            self._counters[('tokens', expert, 'input')] += input_tokens
+            self._counters[('tokens', expert, 'output')] += output_tokens
+            self._samples[expert].append({
+                'status': status, 'cache': cache, 'latency': latency, 'ttft': ttft,
+                'connect': connect, 'input_tokens': input_tokens,
+                'output_tokens': output_tokens, 'retries': retries
+            })
+
+    def upstream_latency_percentile(self, expert: str, pct: float, min_samples: int) -> Optional[float]:
+        """Percentile of recent successful API call latency, or None with too few samples"""
+        with self._lock:
+            latencies = [c['latency'] for c in self._samples.get(expert, ()) if c['status'] == "200"]
+        return percentile(latencies, pct) if len(latencies) >= min_samples else None
+
+    def summary(self) -> List[dict]:
+        """Per-expert percentiles and rates over the recent window"""
+        with self._lock:
+            samples = {expert: list(calls) for expert, calls in self._samples.items()}
+        rows = []
+        for expert, calls in sorted(samples.items()):
+            latencies = [c['latency'] for c in calls]
+            ttfts = [c['ttft'] for c in calls if c['ttft'] is not None]
+            upstream = [c for c in calls if c['status'] != "cached"]
+            errors = [c for c in upstream if c['status'] != "200"]
+            rows.append({
+                'expert': expert,
+                'calls': len(calls),
+                'p50': percentile(latencies, 50),
+                'p95': percentile(latencies, 95),
+                'p99': percentile(latencies, 99),
+                'ttft_p50': percentile(ttfts, 50),
+                'ttft_p95': percentile(ttfts, 95),
+                'error_rate': len(errors) / len(upstream) if upstream else 0.0,
+                'cache_hit_rate': sum(c['cache'] == "hit" for c in calls) / len(calls),
+                'retries': sum(c['retries'] for c in calls),
+                'avg_output_tokens': (sum(c['output_tokens'] for c in upstream) / len(upstream)
+                                      if upstream else 0.0),
+                'errors': dict(Counter(c['status'] for c in errors))
+            })
+        return rows
+
+    def prometheus_lines(self) -> List[str]:
+        """Histograms and counters in the Prometheus text exposition format"""
+        with self._lock:
+            histograms = {key: (h.cumulative(), h.sum, h.count) for key, h in self._histograms.items()}
+            counters = dict(self._counters)
+        lines = []
+        for name, (metric, help_text) in self.HISTOGRAMS.items():
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} histogram"]
+            for (kind, expert), (buckets, total, count) in sorted(histograms.items()):
+                if kind != name:
+                    continue
+                for le, running in buckets:
+                    lines.append(f'{metric}_bucket{{expert="{expert}",le="{le}"}} {running}')
+                lines.append(f'{metric}_sum{{expert="{expert}"}} {total:.6f}')
+                lines.append(f'{metric}_count{{expert="{expert}"}} {count}')
+        families = [
+            ('requests', "his220_ai_requests_total", "Answered questions by outcome", ("status", "cache")),
+            ('retries', "his220_ai_retries_total", "Upstream retries after 429/5xx or connection errors", ()),
+            ('tokens', "his220_ai_tokens_total", "Tokens reported in API usage", ("direction",))
+        ]
+        for kind, metric, help_text, labels in families:
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+            for key, value in sorted(counters.items()):
+                if key[0] != kind:
+                    continue
+                pairs = [f'expert="{key[1]}"'] + [f'{label}="{v}"' for label, v in zip(labels, key[2:])]
+                lines.append(f"{metric}{{{','.join(pairs)}}} {value}")
+        return lines
+
+@st.cache_resource(show_spinner=False)
+def get_ai_metrics() -> AIMetrics:
+    """Process-wide AI call metrics"""
+    return AIMetrics(sample_size=int(get_setting("METRICS_SAMPLE_SIZE", 2048)))
+
+def record_api_call(expert: str, started: float, status: str, cache: str,
+                    response: Optional[requests.Response] = None, usage: Optional[dict] = None,
+                    first_token: Optional[float] = None) -> None:
+    """Record an upstream call; first_token defaults to the end for non-streamed answers"""
+    finished = time.perf_counter()
+    usage = usage or {}
+    get_ai_metrics().record(
+        expert, status, cache,
+        latency=finished - started,
+        ttft=(first_token or finished) - started if status == "200" else None,
+        connect=getattr(response, "connect_seconds", None),
+        input_tokens=(usage.get("input_tokens", 0) + usage.get("cache_read_input_tokens", 0)
+                      + usage.get("cache_creation_input_tokens", 0)),
+        output_tokens=usage.get("output_tokens", 0),
+        retries=getattr(response, "retries", 0)
+    )
+
+# 🪁 HEDGED REQUESTS
+class RequestHedger:
+    """Decide when to hedge a slow expert call and keep the hedge rate under a cap.
+    
+    Each call's latency is kept next to the latency its first request alone
+    would have had, so stats() can show what hedging did to p99.
+    """
+
+    def __init__(self, metrics: AIMetrics, max_rate: float, min_delay: float,
+                 min_samples: int, window: int = 500):
+        self.metrics = metrics
+        self.max_rate = max_rate
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._calls = deque(maxlen=window)
+        self._stats = {'calls': 0, 'hedges': 0, 'hedge_wins': 0, 'capped': 0}
+
+    def hedge_delay(self, expert: str) -> Optional[float]:
+        """Observed p95 for this expert (floored), or None until there is enough history"""
+        p95 = self.metrics.upstream_latency_percentile(expert, 95, self.min_samples)
+        return None if p95 is None else max(self.min_delay, p95)
+
+    def begin(self) -> dict:
+        entry = {'observed': None, 'primary': None, 'hedged': False}
+        with self._lock:
+            self._calls.append(entry)
+            self._stats['calls'] += 1
+        return entry
+
+    def try_hedge(self, entry: dict) -> bool:
+        """Claim a hedge for this call unless the recent hedge rate is at the cap"""
+        with self._lock:
+            hedged = sum(call['hedged'] for call in self._calls)
+            if hedged + 1 > self.max_rate * len(self._calls):
+                self._stats['capped'] += 1
+                return False
+            entry['hedged'] = True
+            self._stats['hedges'] += 1
+            return True
+
+    def finish(self, entry: dict, seconds: float, hedge_won: bool) -> None:
+        with self._lock:
+            entry['observed'] = seconds
+            if hedge_won:
+                self._stats['hedge_wins'] += 1
+
+    def record_primary(self, entry: dict, seconds: float) -> None:
+        """Latency of the first request alone, known even when the hedge won"""
+        with self._lock:
+            entry['primary'] = seconds
+
+    def stats(self) -> dict:
+        """Counters plus observed vs first-request-only p99 over the recent window"""
+        with self._lock:
+            stats = dict(self._stats)
+            done = [call for call in self._calls
+                    if call['observed'] is not None and call['primary'] is not None]
+        stats['hedge_rate'] = stats['hedges'] / stats['calls'] if stats['calls'] else 0.0
+        stats['p99'] = percentile([call['observed'] for call in done], 99)
+        stats['p99_unhedged'] = percentile([call['primary'] for call in done], 99)
+        return stats
+
+def hedging_enabled() -> bool:
+    return str(get_setting("HEDGE_REQUESTS", "false")).lower() in ("1", "true", "yes", "on")
+
+@st.cache_resource(show_spinner=False)
+def get_request_hedger() -> RequestHedger:
+    """Process-wide hedging policy"""
+    return RequestHedger(
+        metrics=get_ai_metrics(),
+        max_rate=float(get_setting("HEDGE_MAX_RATE", 0.05)),
+        min_delay=float(get_setting("HEDGE_MIN_DELAY_SECONDS", 1.0)),
+        min_samples=int(get_setting("HEDGE_MIN_SAMPLES", 20))
+    )
+
+@st.cache_resource(show_spinner=False)
+def get_hedge_executor() -> ThreadPoolExecutor:
+    """Threads that run both copies of a hedged request"""
+    return ThreadPoolExecutor(max_workers=int(get_setting("HEDGE_MAX_WORKERS", 16)),
+                              thread_name_prefix="his220-hedge")
+
+def response_message(response: requests.Response) -> dict:
+    """The Messages API body of a 200 response, whether it was read whole or streamed"""
+    message = getattr(response, "message", None)
+    return message if message is not None else response.json()
+
+def send_streamed_copy(api_key: str, data: dict, cancelled: threading.Event) -> requests.Response:
+    """One copy of a hedged request, streamed so it can stop as soon as its twin answers.
+    
+    The text deltas are collected into response.message, shaped like a
+    non-streamed body. Closing the stream mid-answer drops the connection, and
+    the API stops generating the losing copy.
+    """
+    response = send_messages_request(api_key, {**data, "stream": True}, stream=True, cancelled=cancelled)
+    if response.status_code != 200:
+        return response
+    text, usage = [], {}
+    with response:
+        for event, payload in iter_sse_events(response):
+            if cancelled.is_set():
+                # Output so far is not reported yet; estimate it so the limiter is not over-refunded
+                usage["output_tokens"] = len("".join(text)) // 4
+                settle_usage(usage, response.token_estimate)
+                raise RequestCancelled("a hedged copy of this request already answered")
+            if event == "content_block_delta" and payload["delta"].get("type") == "text_delta":
+                text.append(payload["delta"]["text"])
+            elif event == "message_start":
+                usage.update(payload["message"].get("usage", {}))
+            elif event == "message_delta":
+                usage.update(payload.get("usage", {}))
+            elif event == "error":
+                raise requests.exceptions.RequestException(
+                    payload.get("error", {}).get("message", "stream interrupted"))
+    response.message = {"content": [{"type": "text", "text": "".join(text)}], "usage": usage}
+    return response
+
+def discard_response(future) -> None:
+    """Settle and close the losing copy of a hedged request"""
+    try:
+        response = future.result()
+    except Exception:
+        return
+    try:
+        if response.status_code == 200:
+            settle_usage(response_message(response).get("usage", {}), response.token_estimate)
+    except ValueError:
+        pass
+    finally:
+        response.close()
+
+def send_hedged_request(api_key: str, data: dict, specialist_name: str,
+                        on_wait: Optional[Callable[[int, float], None]] = None) -> requests.Response:
+    """Send a non-streamed Messages request, racing a second copy if the first runs past p95.
+    
+    Without hedging (disabled, or too little history) this is send_messages_request.
+    Otherwise both copies are streamed on hedge threads (see send_streamed_copy), so
+    the loser is cut off when the winner finishes and on_wait is not reported.
+    """
+    hedger = get_request_hedger()
+    delay = hedger.hedge_delay(specialist_name) if hedging_enabled() else None
+    if delay is None:
+        return send_messages_request(api_key, data, on_wait=on_wait)
+    
+    executor = get_hedge_executor()
+    entry = hedger.begin()
+    started = time.perf_counter()
+    cancelled = threading.Event()
+    primary = executor.submit(send_streamed_copy, api_key, data, cancelled)
+    primary.add_done_callback(lambda f: None if isinstance(f.exception(), RequestCancelled)
+                              else hedger.record_primary(entry, time.perf_counter() - started))
+    try:
+        response = primary.result(timeout=delay)
+        hedger.finish(entry, time.perf_counter() - started, hedge_won=False)
+        return response
+    except FutureTimeoutError:
+        pass
+    if not hedger.try_hedge(entry):
+        response = primary.result()
+        hedger.finish(entry, time.perf_counter() - started, hedge_won=False)
+        return response
+    
+    hedge = executor.submit(send_streamed_copy, api_key, data, cancelled)
+    pending = {primary, hedge}
+    while True:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        future = done.pop()
+        succeeded = future.exception() is None and future.result().status_code == 200
+        if succeeded or not pending:
+            break
+        discard_response(future)
+    
+    # The loser closes its stream at its next event (or skips its next retry); its usage is still settled
+    cancelled.set()
+    for other in pending:
+        other.add_done_callback(discard_response)
+    hedger.finish(entry, time.perf_counter() - started, hedge_won=future is hedge)
+    return future.result()
+
+# 💾 SHARED ANSWER CACHE
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+def normalize_question(question: str) -> str:
+    """Normalize a question so trivial differences share a cache entry"""
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.rstrip("?!. ")
+
+class AnswerCache:
+    """SQLite-backed answer cache with TTL expiry and LRU eviction, shared by all sessions.
+    
+    Pinned entries (pre-generated FAQ answers) never expire, are not evicted and
+    do not count toward max_entries.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS answers (
+                key TEXT PRIMARY KEY,
+                expert TEXT NOT NULL,
+                question TEXT NOT NULL,
+                resident INTEGER NOT NULL,
+                model TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                pinned INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(answers)")}
+        if "pinned" not in columns:
+            self._conn.execute("ALTER TABLE answers ADD COLUMN pinned INTEGER NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0}
+
+    @staticmethod
+    def make_key(expert: str, question: str, resident: bool, model: str) -> str:
+        """Stable cache key for an (expert, normalized question, resident flag, model) tuple"""
+        raw = "|".join([expert, normalize_question(question), str(int(resident)), model])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, expert: str, question: str, resident: bool, model: str,
+            count: bool = True) -> Optional[str]:
+        """Return a cached answer, or None on a miss or expired entry.
         
-        ## Early Detroit Characteristics
-        * **Fort Pontchartrain** - Military and trading post
-        * **Ribbon farms** - Long, narrow plots along river
-        * **Multicultural population** - French, Native Americans, eventually British
-        * **Trading hub** - Controlled Great Lakes water route
+        With count=False the lookup leaves hits/misses alone so a caller making
+        several lookups for one question can record a single outcome.
+        """
+        key = self.make_key(expert, question, resident, model)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT answer, created_at, pinned FROM answers WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self._stats['misses'] += count
+                return None
+            answer, created_at, pinned = row
+            if not pinned and now - created_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM answers WHERE key = ?", (key,))
+                self._conn.commit()
+                self._stats['expired'] += 1
+                self._stats['misses'] += count
+                return None
+            self._conn.execute("UPDATE answers SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self._stats['hits'] += count
+            return answer
+
+    def record_lookup(self, hit: bool) -> None:
+        """Count one hit or miss for a lookup made with count=False"""
+        with self._lock:
+            self._stats['hits' if hit else 'misses'] += 1
+
+    def put(self, expert: str, question: str, resident: bool, model: str, answer: str,
+            pinned: bool = False) -> None:
+        """Store an answer and evict the least recently used unpinned entries past the size cap"""
+        key = self.make_key(expert, question, resident, model)
+        now = time.time()
+        with self._lock:
+            # A live answer never replaces a pinned one; a pinned answer replaces anything
+            self._conn.execute(
+                "INSERT INTO answers VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET answer = excluded.answer, "
+                "created_at = excluded.created_at, last_used = excluded.last_used, "
+                "pinned = excluded.pinned WHERE excluded.pinned OR NOT answers.pinned",
+                (key, expert, normalize_question(question), int(resident), model, answer, now, now, int(pinned))
+            )
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM answers WHERE pinned = 0").fetchone()
+            if count > self.max_entries:
+                evicted = self._conn.execute(
+                    "DELETE FROM answers WHERE key IN "
+                    "(SELECT key FROM answers WHERE pinned = 0 ORDER BY last_used ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                ).rowcount
+                self._stats['evictions'] += evicted
+            self._conn.commit()
+
+    def entries(self) -> List[tuple]:
+        """All stored (expert, normalized question, resident, model) tuples"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT expert, question, resident, model FROM answers"
+            ).fetchall()
+
+    def stats(self) -> dict:
+        """Snapshot of hit/miss counters"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'], stats['pinned'] = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(pinned), 0) FROM answers"
+            ).fetchone()
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+@st.cache_resource(show_spinner=False)
+def get_answer_cache() -> AnswerCache:
+    """Process-wide answer cache, persisted to a local SQLite file"""
+    return AnswerCache(
+        path=get_setting("ANSWER_CACHE_PATH", os.path.join(DATA_DIR, "answer_cache.sqlite3")),
+        ttl_seconds=float(get_setting("ANSWER_CACHE_TTL_SECONDS", 7 * 24 * 3600)),
+        max_entries=int(get_setting("ANSWER_CACHE_MAX_ENTRIES", 5000))
+    )
+
+# 🤝 IN-FLIGHT REQUEST COALESCING
+class SingleFlight:
+    """Let concurrent identical requests share one upstream call"""
+
+    class Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {'leaders': 0, 'coalesced': 0, 'fallbacks': 0}
+
+    def begin(self, key: str) -> tuple:
+        """Return (is_leader, call); only the leader should do the upstream work"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                return False, call
+            call = self._calls[key] = self.Call()
+            self._stats['leaders'] += 1
+            return True, call
+
+    def finish(self, key: str, call: "SingleFlight.Call", result: Optional[str]) -> None:
+        """Publish the leader's result; None means waiters must make their own call"""
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.result = result
+        call.done.set()
+
+    def wait(self, call: "SingleFlight.Call") -> Optional[str]:
+        """Block until the leader finishes and return its shared result"""
+        call.done.wait()
+        with self._lock:
+            if call.result is None:
+                self._stats['fallbacks'] += 1
+            else:
+                self._stats['coalesced'] += 1
+        return call.result
+
+    def do(self, key: str, fn: Callable[[], str]) -> str:
+        """Run fn once for all concurrent callers with the same key"""
+        leader, call = self.begin(key)
+        if not leader:
+            result = self.wait(call)
+            return result if result is not None else fn()
+        result = None
+        try:
+            result = fn()
+            return result
+        finally:
+            # A leader interrupted mid-call (e.g. by a rerun) publishes None
+            self.finish(key, call, result)
+
+    def stats(self) -> dict:
+        """Snapshot of leader/waiter counters; 'coalesced' is upstream calls saved"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._calls)
+        return stats
+
+@st.cache_resource(show_spinner=False)
+def get_singleflight() -> SingleFlight:
+    """Process-wide registry of in-flight expert questions"""
+    return SingleFlight()
+
+def specialist_flight_key(api_key: str, specialist_name: str, question: str,
+                          resident_verified: bool, user_location: str = None, context: str = "") -> str:
+    """Identity of an expert question for coalescing; the key hash keeps tenants apart"""
+    return "|".join([
+        APIKeyValidator.key_hash(api_key)[:16], specialist_name,
+        normalize_question(question), str(int(resident_verified)), user_location or "", context
+    ])
+
+# 🔎 NEAR-DUPLICATE QUESTION MATCHING
+QUESTION_STOPWORDS = {
+    "a", "an", "the", "of", "in", "on", "to", "and", "or", "is", "was", "were", "are",
+    "did", "do", "does", "what", "who", "how", "why", "when", "where", "which", "me",
+    "tell", "about", "can", "you", "i", "it", "its", "for", "by", "with"
+}
+
+QUESTION_WORDS = ("who", "what", "when", "where", "why", "how", "which")
+NEGATION_WORDS = {"not", "no", "never", "without", "nor"}
+# Course-specific rewordings that should land on the same stored question
+QUESTION_SYNONYMS = {
+    "start": "found", "started": "founded", "starting": "founding",
+    "establish": "found", "established": "founded", "establishing": "founding"
+}
+
+def question_features(question: str, with_numbers: bool = True) -> Counter:
+    """Character trigram counts over the content words of a normalized question"""
+    features = Counter()
+    for word in re.findall(r"\w+", normalize_question(question)):
+        if word in QUESTION_STOPWORDS or (not with_numbers and word.isdigit()):
+            continue
+        padded = f" {QUESTION_SYNONYMS.get(word, word)} "
+        features.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return features
+
+def question_intent(question: str) -> tuple:
+    """(question word, negated); trigrams alone cannot tell "who" from "when" or see a negation"""
+    normalized = normalize_question(question)
+    words = re.findall(r"\w+", normalized)
+    question_word = next((word for word in words if word in QUESTION_WORDS), "")
+    negated = bool(NEGATION_WORDS.intersection(words)) or "n't" in normalized
+    return question_word, negated
+
+def question_numbers(question: str) -> frozenset:
+    """Years and other numbers, which must match exactly rather than by trigrams"""
+    return frozenset(re.findall(r"\d+", normalize_question(question)))
+
+class QuestionIndex:
+    """Incremental TF-IDF index over past questions, partitioned by expert, resident flag, model
+    and question intent; numbers in the new question must all appear in the stored one"""
+
+    def __init__(self, threshold: float, max_candidates: int = 32, probe_terms: int = 4):
+        self.threshold = threshold
+        self.max_candidates = max_candidates
+        self.probe_terms = probe_terms
+        self._lock = threading.Lock()
+        self._partitions = defaultdict(lambda: {
+            'postings': defaultdict(set),
+            'vectors': {},
+            'numbers': {},
+            'questions': []
+        })
+        self._doc_freq = defaultdict(Counter)
+        self._seen = set()
+        self._stats = {'lookups': 0, 'matches': 0}
+
+    def _idf(self, partition: tuple, term: str) -> float:
+        docs = len(self._partitions[partition]['questions'])
+        return math.log((docs + 1) / (self._doc_freq[partition][term] + 1)) + 1.0
+
+    def _vector(self, partition: tuple, features: Counter) -> Dict[str, float]:
+        weights = {term: count * self._idf(partition, term) for term, count in features.items()}
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        return {term: w / norm for term, w in weights.items()}
+
+    def add(self, expert: str, question: str, resident: bool, model: str) -> None:
+        """Index a question; document weights use the IDF at insertion time"""
+        normalized = normalize_question(question)
+        partition = (expert, bool(resident), model) + question_intent(normalized)
+        features = question_features(normalized, with_numbers=False)
+        with self._lock:
+            if (partition, normalized) in self._seen or not features:
+                return
+            self._seen.add((partition, normalized))
+            index = self._partitions[partition]
+            self._doc_freq[partition].update(features.keys())
+            doc_id = len(index['questions'])
+            index['questions'].append(normalized)
+            index['vectors'][doc_id] = self._vector(partition, features)
+            index['numbers'][doc_id] = question_numbers(normalized)
+            for term in features:
+                index['postings'][term].add(doc_id)
+
+    def match(self, expert: str, question: str, resident: bool, model: str) -> Optional[tuple]:
+        """Return (stored question, similarity) for the closest question above the threshold"""
+        partition = (expert, bool(resident), model) + question_intent(question)
+        features = question_features(question, with_numbers=False)
+        numbers = question_numbers(question)
+        with self._lock:
+            self._stats['lookups'] += 1
+            index = self._partitions.get(partition)
+            if not index or not features:
+                return None
+            query = self._vector(partition, features)
+            # Rare terms are the most selective, so only their postings seed candidates,
+            # and only the documents sharing the most of them are scored exactly
+            doc_freq = self._doc_freq[partition]
+            votes = Counter()
+            known = [term for term in query if doc_freq[term]]
+            for term in sorted(known, key=lambda t: doc_freq[t])[:self.probe_terms]:
+                votes.update(index['postings'].get(term, ()))
+            best_id, best_score = None, 0.0
+            for doc_id, _ in votes.most_common(self.max_candidates):
+                if not numbers <= index['numbers'][doc_id]:
+                    continue
+                vector = index['vectors'][doc_id]
+                score = sum(weight * query.get(term, 0.0) for term, weight in vector.items())
+                if score > best_score:
+                    best_id, best_score = doc_id, score
+            if best_id is None or best_score < self.threshold:
+                return None
+            self._stats['matches'] += 1
+            return index['questions'][best_id], best_score
+
+    def stats(self) -> dict:
+        """Snapshot of lookup counters and index size"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['questions'] = sum(len(p['questions']) for p in self._partitions.values())
+        return stats
+
+@st.cache_resource(show_spinner=False)
+def get_question_index() -> QuestionIndex:
+    """Process-wide similarity index, seeded from the persistent answer cache"""
+    index = QuestionIndex(threshold=float(get_setting("SIMILAR_QUESTION_THRESHOLD", 0.75)))
+    for expert, question, resident, model in get_answer_cache().entries():
+        index.add(expert, question, resident, model)
+    return index
+
+def lookup_cached_answer(expert: str, question: str, resident: bool, model: str) -> Optional[str]:
+    """Exact cache lookup, falling back to the closest previously answered question"""
+    cache = get_answer_cache()
+    answer = cache.get(expert, question, resident, model, count=False)
+    if answer is None:
+        match = get_question_index().match(expert, question, resident, model)
+        if match:
+            answer = cache.get(expert, match[0], resident, model, count=False)
+    cache.record_lookup(answer is not None)
+    return answer
+
+def store_answer(expert: str, question: str, resident: bool, model: str, answer: str,
+                 pinned: bool = False) -> None:
+    """Save an answer to the cache and make its question matchable"""
+    get_answer_cache().put(expert, question, resident, model, answer, pinned)
+    get_question_index().add(expert, question, resident, model)
+
+# ✅ SHARED API KEY VALIDATION
+def probe_api_key(api_key: str, client: AnthropicHTTPClient) -> tuple:
+    """Send a minimal Messages request to check whether an API key works.
+    
+    Returns (working, message). Only a 401 is a verdict against the key; rate
+    limits, server errors and an unreachable API give working=None.
+    """
+    test_data = {
+        "model": "claude-3-haiku-20240307",
+        "max_tokens": 10,
+        "messages": [{"role": "user", "content": "Hello"}]
+    }
+    
+    breaker = get_circuit_breaker()
+    if not breaker.allow():
+        return None, "Michigan State AI is temporarily unavailable"
+    try:
+        get_rate_limiter().acquire(estimate_request_tokens(test_data))
+        try:
+            response = client.post(api_key, test_data, read_timeout=10)
+        except requests.exceptions.RequestException:
+            breaker.record_failure()
+            raise
+        breaker.record_status(response.status_code)
         
-        ## Geographic Advantages
-        * **Detroit River** - Natural highway for transportation
-        * **Fertile land** - Agricultural potential
-        * **Strategic military position** - Control of Great Lakes access
-        """,
-        "presenter_notes": "Connect Detroit's founding to its continued importance as a transportation hub.",
-        "timer_minutes": 15,
-        "activity_type": "discussion",
-        "background_color": "#f0fff0",
-        "interactive_map": True
-    },
-    {
-        "id": "assessment",
-        "title": "Course Assessment Methods",
-        "content": """
-        # 📝 How You'll Be Assessed
+        if response.status_code == 200:
+            return True, "API key working"
+        elif response.status_code == 401:
+            return False, "Invalid API key"
+        elif response.status_code == 429:
+            return None, "Rate limited"
+        else:
+            return None, f"HTTP {response.status_code}"
+    except Exception as e:
+        return None, f"Connection error: {str(e)}"
+
+class APIKeyValidator:
+    """Process-wide cache of API key checks, keyed by a hash of the key and refreshed in the background"""
+
+    # Only these outcomes are definitive. Anything else (rate limits, server or
+    # network errors) is stored as working=None, which never blocks a question,
+    # and is rechecked after the shorter retry interval
+    DEFINITIVE = {"API key working", "Invalid API key"}
+
+    def __init__(self, client: AnthropicHTTPClient, ttl_seconds: float, retry_seconds: float):
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self.retry_seconds = retry_seconds
+        self._lock = threading.Lock()
+        self._results = {}
+        self._inflight = {}
+
+    @staticmethod
+    def key_hash(api_key: str) -> str:
+        return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+    def _is_fresh(self, entry: tuple) -> bool:
+        working, message, checked_at = entry
+        ttl = self.ttl_seconds if message in self.DEFINITIVE else self.retry_seconds
+        return time.time() - checked_at < ttl
+
+    def _refresh(self, api_key: str) -> threading.Event:
+        """Start a background probe for this key unless one is already running"""
+        digest = self.key_hash(api_key)
+        with self._lock:
+            done = self._inflight.get(digest)
+            if done is not None:
+                return done
+            done = self._inflight[digest] = threading.Event()
+        
+        def run():
+            working, message = probe_api_key(api_key, self.client)
+            with self._lock:
+                self._results[digest] = (working, message, time.time())
+                del self._inflight[digest]
+            done.set()
         
-        ## Assessment Variety
-        * **Examinations** - Test comprehension and analysis
-        * **Quizzes** - Regular knowledge checks
-        * **Case Studies** - Analyze historical scenarios
-        * **Oral Conversations** - Discuss historical topics
-        * **Group Discussions** - Collaborative learning
-        * **Oral Presentations** - Share research findings
+        threading.Thread(target=run, name="api-key-probe", daemon=True).start()
+        return done
+
+    def peek(self, api_key: str) -> Optional[tuple]:
+        """Return the last known (working, message) without blocking, refreshing it if stale"""
+        with self._lock:
+            entry = self._results.get(self.key_hash(api_key))
+        if entry is None or not self._is_fresh(entry):
+            self._refresh(api_key)
+        return entry[:2] if entry else None
+
+    def validate(self, api_key: str) -> tuple:
+        """Return (working, message), waiting for a probe only if the key was never checked"""
+        result = self.peek(api_key)
+        if result is not None:
+            return result
+        self._refresh(api_key).wait(self.client.connect_timeout + 10)
+        return self.peek(api_key) or (None, "Connection error: key check timed out")
+
+    def invalidate(self, api_key: str, message: str = "Invalid API key") -> None:
+        """Record a definitive failure seen on a real request (e.g. HTTP 401)"""
+        with self._lock:
+            self._results[self.key_hash(api_key)] = (False, message, time.time())
+
+@st.cache_resource(show_spinner=False)
+def get_key_validator() -> APIKeyValidator:
+    """Process-wide API key validator shared by every session"""
+    return APIKeyValidator(
+        client=get_http_client(),
+        ttl_seconds=float(get_setting("API_KEY_CHECK_TTL_SECONDS", 15 * 60)),
+        retry_seconds=float(get_setting("API_KEY_CHECK_RETRY_SECONDS", 30))
+    )
+
+def test_api_key():
+    """Test if the API key works, reusing the process-wide cached result"""
+    api_key = get_api_key()
+    if not api_key:
+        return False, "No API key provided"
+    return get_key_validator().validate(api_key)
+
+def check_api_ready(api_key: str) -> Optional[str]:
+    """Return a user-facing error message if the API key is missing or not working"""
+    if not api_key:
+        return """🔑 **API Key Missing**
         
-        ## Grading Scale
-        * **A: 90%-100%** - Exceptional work
-        * **B: 80%-89.9%** - Good work  
-        * **C: 70%-79.9%** - Satisfactory work
-        * **D: 60%-69.9%** - Below expectations
-        * **E: <60%** - Unsatisfactory work
+No Anthropic API key found. Please add your API key to Streamlit secrets as `ANTHROPIC_API_KEY` or enter it in the sidebar for testing.
+
+To get an API key:
+1. Go to console.anthropic.com
+2. Create an account
+3. Generate an API key
+4. Add it to your Streamlit secrets"""
+    
+    # While the API is down, skip the key check so degraded answers come back at once
+    if get_circuit_breaker().is_open():
+        return None
+    
+    # Key checks are shared across sessions, so this only waits on the very first one.
+    # An unreachable API (working is None) goes on to the breaker and degraded answers.
+    working, message = get_key_validator().validate(api_key)
+    if working is False:
+        return f"""❌ **API Key Issue**
         
-        ## Success Strategies
-        * **Regular attendance** and participation
-        * **Engage with Michigan State AI** for additional help
-        * **Connect historical patterns** to modern Michigan
-        """,
-        "presenter_notes": "Emphasize the variety of assessment methods available to accommodate different learning styles.",
-        "background_color": "#fff0f5"
+{message}
+
+Please check your API key and try again. Make sure:
+- Key starts with 'sk-ant-api03-'
+- Key is active and has credits
+- No extra spaces or characters"""
+    
+    return None
+
+def build_system_prompt(specialist_name: str, resident_verified: bool) -> str:
+    """Render a specialist's system prompt"""
+    specialist = get_experts()[specialist_name]
+    
+    resident_context = ""
+    if resident_verified:
+        resident_context = f"""
+IMPORTANT: This user is a verified Michigan resident. {specialist['resident_focus']}
+
+Provide practical, actionable information that helps them as a Michigan resident. Connect historical knowledge to current opportunities, challenges, and resources available in Michigan.
+"""
+    
+    return f"""You are {specialist['name']}, {specialist['title']}.
+
+Background: {specialist['background']}
+
+Your expertise areas:
+{chr(10).join(f"- {area}" for area in specialist['key_areas'])}
+
+Your personality: {specialist['personality']}
+
+{resident_context}
+
+Respond as this specialist, providing educational content that helps the user understand Michigan history and its relevance today. Be helpful, knowledgeable, and encouraging. Keep responses to 2-3 paragraphs unless the question requires more detail."""
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def get_specialist_system_blocks(experts_version: str) -> Dict[tuple, list]:
+    """Every expert x resident system prompt, rendered once per experts.json version as a cacheable block.
+    
+    Streamlit re-executes this file on every rerun, so the prompts live in
+    cache_resource rather than a module constant. Byte-identical prefixes are
+    what let the API reuse its prompt cache between calls.
+    """
+    return {
+        (specialist_name, resident): [{
+            "type": "text",
+            "text": build_system_prompt(specialist_name, resident),
+            "cache_control": {"type": "ephemeral"}
+        }]
+        for specialist_name in get_experts()
+        for resident in (False, True)
     }
-]
-
-# Michigan State AI Expert Profiles
-MICHIGAN_AI_EXPERTS = {
-    "Historical_Expert": {
-        "name": "Dr. Margaret Winters",
-        "title": "Michigan State AI - Historical Expert",
-        "expertise": "Michigan history from French exploration through modern times, with special focus on political and social developments",
-        "background": "I am a digital historian specializing in Michigan's development. I have deep knowledge of how geographical, political, and social factors shaped our state from Native American settlements through the automotive age to today's innovations.",
-        "resident_focus": "I help Michigan residents understand how our state's history connects to current issues, local governance, economic opportunities, and community development.",
-        "key_areas": [
-            "French exploration and Native American relations",
-            "Territorial period and statehood",
-            "Civil War and Reconstruction era",
-            "Industrial revolution and labor movements",
-            "Modern political and social developments"
-        ],
-        "personality": "scholarly but accessible, connects historical patterns to current events, passionate about Michigan's unique story"
+
+ERROR_RESPONSE_PREFIXES = ("🔑", "❌", "⏰", "🌐", "🚫", "📖")
+
+def is_error_response(response: str) -> bool:
+    """True for the user-facing error messages this app returns instead of answers"""
+    return response.lstrip().startswith(ERROR_RESPONSE_PREFIXES)
+
+def summarize_turn(turn: dict) -> str:
+    """One-line extractive summary of an earlier question and answer"""
+    answer = re.sub(r"\s+", " ", turn['response']).strip()
+    first_sentence = re.split(r"(?<=[.!?])\s", answer, maxsplit=1)[0]
+    return f"- Student asked: {turn['question'][:100].strip()} | You said: {first_sentence[:200]}"
+
+def compact_history(history: List[dict], budget_tokens: int, summary_tokens: int) -> tuple:
+    """Split prior turns into (recent turns sent verbatim, summary of older turns).
+    
+    Recent turns are kept newest-first until the token budget is spent; older
+    ones are folded into a capped running summary so request size stays flat.
+    """
+    turns = [turn for turn in history if not is_error_response(turn['response'])]
+    recent, used = [], 0
+    for turn in reversed(turns):
+        cost = (len(turn['question']) + len(turn['response'])) // 4
+        if used + cost > budget_tokens:
+            break
+        recent.insert(0, turn)
+        used += cost
+    
+    summary, used = [], 0
+    for turn in reversed(turns[:len(turns) - len(recent)]):
+        line = summarize_turn(turn)
+        if used + len(line) // 4 > summary_tokens:
+            break
+        summary.insert(0, line)
+        used += len(line) // 4
+    return recent, "\n".join(summary)
+
+# Words that point back at earlier turns; questions without them are answered
+# standalone so they can come from the shared cache like anyone else's
+FOLLOW_UP_PATTERN = re.compile(
+    r"^(?:and|but|so|also|what about|how about)\b|"
+    r"\b(?:it|its|they|them|their|that|this|those|these|he|she|him|his|her|you said|"
+    r"earlier|previous|above|more|else|again|elaborate|expand|explain further)\b"
+)
+
+def looks_like_follow_up(question: str) -> bool:
+    """True for questions that only make sense with the conversation so far"""
+    text = normalize_question(question)
+    return len(text.split()) <= 3 or bool(FOLLOW_UP_PATTERN.search(text))
+
+# 🧭 QUESTION ROUTING
+# Override with a MODEL_ROUTES setting (same shape, as JSON) to change models or budgets
+MODEL_ROUTES = {
+    "factual": {
+        "model": "claude-3-haiku-20240307",
+        "max_tokens": 200,
+        "guidance": "A short, direct answer of a few sentences is best."
     },
-    "Geography_Expert": {
-        "name": "Dr. James Lakeshore",
-        "title": "Michigan State AI - Geography & Development Expert", 
-        "expertise": "How Michigan's unique geography influenced development, natural resources, transportation, and settlement patterns",
-        "background": "I specialize in understanding how Michigan's geography - our Great Lakes location, natural resources, and climate - shaped every aspect of our development and continues to influence life here today.",
-        "resident_focus": "I help Michigan residents understand how geography affects everything from job opportunities to recreation, climate challenges, and why certain industries developed where they did.",
-        "key_areas": [
-            "Great Lakes influence on development",
-            "Natural resources and industry location",
-            "Transportation networks and trade routes",
-            "Climate patterns and agricultural development",
-            "Urban development patterns"
-        ],
-        "personality": "practical and scientific, emphasizes cause-and-effect relationships, helps residents understand their local environment"
+    "standard": {
+        "model": "claude-3-haiku-20240307",
+        "max_tokens": 500,
+        "guidance": ""
     },
-    "Detroit_Historian": {
-        "name": "Dr. Rosa Martinez", 
-        "title": "Michigan State AI - Detroit Metro Historian",
-        "expertise": "Southeastern Michigan's development, Detroit's rise and transformation, automotive industry, civil rights, urban development",
-        "background": "I focus on southeastern Michigan's unique role in American history - from frontier trading post to industrial powerhouse to modern innovation hub. I understand Detroit's complex story and its impact on the region.",
-        "resident_focus": "I help southeastern Michigan residents understand their communities' histories, current challenges and opportunities, and how Detroit's story connects to broader Michigan development.",
-        "key_areas": [
-            "Detroit's founding and early development", 
-            "Automotive industry rise and impact",
-            "Great Migration and demographic changes",
-            "Civil rights movements and social justice",
-            "Urban renewal, decline, and revitalization efforts"
-        ],
-        "personality": "passionate about urban history, understands complex social dynamics, optimistic about Detroit's future while acknowledging challenges"
+    "analytical": {
+        "model": "claude-sonnet-4-5-20250929",
+        "max_tokens": 900,
+        "guidance": "Take the space you need to compare, explain causes, and give examples."
     }
 }
 
-# Enhanced quiz questions
-QUIZ_DATA = {
-    "michigan_basics": {
-        "title": "Michigan History Fundamentals", 
-        "questions": [
-            {
-                "question": "Who founded Detroit in 1701?",
-                "options": [
-                    "Jacques Marquette",
-                    "Antoine de la Mothe Cadillac", 
-                    "René-Robert Cavelier",
-                    "Jean Nicolet"
-                ],
-                "correct": 1,
-                "explanation": "Antoine de la Mothe Cadillac founded Detroit on July 24, 1701, establishing Fort Pontchartrain at the strategic location between Lakes Erie and Huron.",
-                "difficulty": "Easy"
-            },
-            {
-                "question": "Which geographic feature most influenced Michigan's early development?",
-                "options": [
-                    "The Appalachian Mountains",
-                    "The Great Plains", 
-                    "The Great Lakes",
-                    "The Mississippi River"
-                ],
-                "correct": 2,
-                "explanation": "Michigan is surrounded by 4 of the 5 Great Lakes, giving it 3,000 miles of freshwater coastline and making water transportation central to its development.",
-                "difficulty": "Medium"
-            },
-            {
-                "question": "What was the primary economic activity during French rule?",
-                "options": [
-                    "Agriculture",
-                    "Manufacturing",
-                    "Fur trading", 
-                    "Mining"
-                ],
-                "correct": 2,
-                "explanation": "The French economy in Michigan centered on fur trading, establishing trading posts and maintaining partnerships with Native American tribes.",
-                "difficulty": "Easy"
-            },
-            {
-                "question": "Which Native American confederacy was important in early Michigan?",
-                "options": [
-                    "Iroquois Confederacy",
-                    "Three Fires Confederacy",
-                    "Powhatan Confederacy", 
-                    "Creek Confederacy"
-                ],
-                "correct": 1,
-                "explanation": "The Three Fires Confederacy included the Ojibwe (Chippewa), Ottawa, and Potawatomi tribes, who were the primary Native groups in the Michigan region.",
-                "difficulty": "Medium"
-            }
-        ]
-    },
-    "geography_influence": {
-        "title": "Geography and Development",
-        "questions": [
-            {
-                "question": "Why was Detroit's location strategically important?",
-                "options": [
-                    "It was the highest point in Michigan",
-                    "It controlled the narrowest point between two Great Lakes",
-                    "It had the most fertile soil",
-                    "It was closest to major Eastern cities"
-                ],
-                "correct": 1,
-                "explanation": "Detroit sits at the narrowest point between Lakes Erie and Huron, making it a crucial control point for Great Lakes navigation and trade.",
-                "difficulty": "Medium"
-            },
-            {
-                "question": "Which natural resource was NOT a major factor in early Michigan development?",
-                "options": [
-                    "Timber",
-                    "Iron ore", 
-                    "Oil deposits",
-                    "Fertile soil"
-                ],
-                "correct": 2,
-                "explanation": "While Michigan had timber, iron ore, and fertile soil that shaped its development, oil deposits were not a significant factor in its early history.",
-                "difficulty": "Hard"
-            }
-        ]
+FACTUAL_OPENERS = ("when", "who", "where", "what year", "how many", "how much", "which", "what is",
+                   "what was", "what were", "is", "was", "did", "define")
+# Any one of these asks for long-form reasoning on its own
+ESSAY_CUES = ("compare", "contrast", "analyze", "analyse", "evaluate", "to what extent", "essay")
+ANALYTICAL_CUES = ESSAY_CUES + ("assess", "significance", "impact", "influence", "relationship",
+                                "differ", "similar", "why did", "why was", "why were", "cause",
+                                "consequence", "effects", "affect", "across", "over time",
+                                "argue", "interpret")
+# Openers are whole words ("who" but not "whole"); cues start a word and may take a
+# suffix ("caused", "impacts") but do not match inside one ("because")
+FACTUAL_OPENER_PATTERN = re.compile(r"(?:%s)\b" % "|".join(map(re.escape, FACTUAL_OPENERS)))
+ESSAY_CUE_PATTERNS = [re.compile(r"\b%s" % re.escape(cue)) for cue in ESSAY_CUES]
+ANALYTICAL_CUE_PATTERNS = [re.compile(r"\b%s" % re.escape(cue)) for cue in ANALYTICAL_CUES]
+
+def classify_question(question: str) -> str:
+    """Cheap local guess at how much answer a question needs: factual, standard or analytical"""
+    text = normalize_question(question)
+    words = text.split()
+    cues = sum(bool(pattern.search(text)) for pattern in ANALYTICAL_CUE_PATTERNS)
+    if (cues >= 2 or len(words) > 40 or question.count("?") > 1 or (cues and len(words) > 12)
+            or any(pattern.search(text) for pattern in ESSAY_CUE_PATTERNS)):
+        return "analytical"
+    if not cues and len(words) <= 12 and FACTUAL_OPENER_PATTERN.match(text):
+        return "factual"
+    return "standard"
+
+class QuestionRouter:
+    """Pick model and output budget for a question from the routing table"""
+
+    def __init__(self, routes: Dict[str, dict]):
+        self.routes = routes
+        self._lock = threading.Lock()
+        self._stats = Counter()
+
+    def route(self, question: str) -> tuple:
+        """(tier, route) for a question; unknown tiers fall back to standard"""
+        tier = classify_question(question)
+        if tier not in self.routes:
+            tier = "standard"
+        with self._lock:
+            self._stats[tier] += 1
+        return tier, self.routes[tier]
+
+    def fallback(self, data: dict) -> Optional[dict]:
+        """The same request on the standard route's model, or None if it already uses that model"""
+        model = self.routes["standard"]["model"]
+        return None if data["model"] == model else {**data, "model": model}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+@st.cache_resource(show_spinner=False)
+def get_question_router() -> QuestionRouter:
+    """Process-wide router over MODEL_ROUTES merged with any configured overrides"""
+    routes = {tier: dict(route) for tier, route in MODEL_ROUTES.items()}
+    overrides = get_setting("MODEL_ROUTES")
+    if isinstance(overrides, str):
+        overrides = json.loads(overrides)
+    for tier, route in (overrides or {}).items():
+        routes[tier] = {**routes.get(tier, MODEL_ROUTES["standard"]), **route}
+    return QuestionRouter(routes)
+
+def build_specialist_request(specialist_name: str, question: str, resident_verified: bool,
+                             user_location: str = None, history: List[dict] = None) -> dict:
+    """Build the Messages API payload for a Michigan State AI specialist"""
+    tier, route = get_question_router().route(question)
+    user_message = f"As a Michigan history specialist, can you help me with this question: {question}"
+    if user_location:
+        user_message += f" (I'm asking from {user_location})"
+    if route.get("guidance"):
+        user_message += f"\n\n{route['guidance']}"
+    
+    system = get_specialist_system_blocks(content_version("experts"))[(specialist_name, bool(resident_verified))]
+    messages = []
+    if history:
+        recent, summary = compact_history(
+            history,
+            budget_tokens=int(get_setting("CONTEXT_TOKEN_BUDGET", 1500)),
+            summary_tokens=int(get_setting("CONTEXT_SUMMARY_TOKENS", 300))
+        )
+        if summary:
+            # Appended after the cached block so the shared prompt prefix is unchanged
+            system = system + [{
+                "type": "text",
+                "text": f"Summary of your earlier conversation with this student:\n{summary}"
+            }]
+        for turn in recent:
+            messages.append({"role": "user", "content": turn['question']})
+            messages.append({"role": "assistant", "content": turn['response']})
+    messages.append({"role": "user", "content": user_message})
+    
+    return {
+        "model": route["model"],
+        "max_tokens": int(route["max_tokens"]),
+        "system": system,
+        "messages": messages
     }
-}
 
-# Resources with working links
-MICHIGAN_RESOURCES = {
-    "videos": [
-        {
-            "title": "Michigan's French Colonial Heritage",
-            "url": "https://www.youtube.com/results?search_query=michigan+french+colonial+history",
-            "description": "Explore the lasting influence of French exploration and settlement",
-            "duration": "12 minutes",
-            "topic": "French Period"
-        },
-        {
-            "title": "Great Lakes: Michigan's Natural Highways", 
-            "url": "https://www.youtube.com/results?search_query=great+lakes+michigan+geography",
-            "description": "How the Great Lakes shaped Michigan's transportation and economy",
-            "duration": "15 minutes",
-            "topic": "Geography"
-        },
-        {
-            "title": "Detroit: From Trading Post to Motor City",
-            "url": "https://www.youtube.com/results?search_query=detroit+history+motor+city",
-            "description": "The transformation of Detroit from French fort to industrial center",
-            "duration": "18 minutes",
-            "topic": "Detroit History"
-        }
-    ],
-    "articles": [
-        {
-            "title": "Michigan History Center - State Timeline",
-            "url": "https://www.michigan.gov/mhc",
-            "description": "Comprehensive timeline of Michigan historical events"
-        },
-        {
-            "title": "Detroit Historical Society Resources", 
-            "url": "https://detroithistorical.org",
-            "description": "Primary sources and Detroit-focused historical materials"
-        },
-        {
-            "title": "Michigan State University - Michigan History",
-            "url": "https://msu.edu",
-            "description": "Academic resources for Michigan history research"
-        }
-    ],
-    "michigan_resident_resources": [
-        {
-            "title": "Michigan Government Services",
-            "url": "https://www.michigan.gov",
-            "description": "Access state services, licensing, and information for residents"
-        },
-        {
-            "title": "Pure Michigan Tourism", 
-            "url": "https://www.michigan.org",
-            "description": "Discover Michigan attractions, events, and natural areas"
-        },
-        {
-            "title": "Michigan Economic Development",
-            "url": "https://www.michiganbusiness.org",
-            "description": "Business resources, job opportunities, and economic data"
+# A routed model that is retired or rejects the request is retried once on the standard route
+MODEL_FALLBACK_STATUS_CODES = {400, 404}
+
+def retry_on_standard_route(response: requests.Response, data: dict,
+                            send: Callable[[dict], requests.Response]) -> requests.Response:
+    """Resend a request refused with 400/404 once on the standard route's model"""
+    if response.status_code not in MODEL_FALLBACK_STATUS_CODES:
+        return response
+    fallback = get_question_router().fallback(data)
+    if fallback is None:
+        return response
+    logger.warning("model %s returned HTTP %s, retrying on %s",
+                   data["model"], response.status_code, fallback["model"])
+    response.close()
+    return send(fallback)
+
+def conversation_context_key(data: dict) -> str:
+    """Fingerprint of the prior-turn context in a request ("" for single-turn questions)"""
+    context = [data["system"][1:], data["messages"][:-1]]
+    if not any(context):
+        return ""
+    return hashlib.sha256(json.dumps(context, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+def api_status_message(status_code: int) -> str:
+    """User-facing message for a non-200 Messages API response"""
+    if status_code == 401:
+        return "🔑 **Authentication Failed** - Your API key is invalid or expired."
+    elif status_code == 429:
+        return "⏰ **Rate Limited** - Too many requests. Please wait a moment and try again."
+    elif status_code == 400:
+        return "❌ **Bad Request** - There was an issue with the request format."
+    else:
+        return f"🚫 **API Error** - HTTP {status_code}. Please try again."
+
+def api_exception_message(error: Exception) -> str:
+    """User-facing message for a failed request"""
+    if isinstance(error, requests.exceptions.Timeout):
+        return "⏰ **Timeout** - The request took too long. Please try again."
+    elif isinstance(error, requests.exceptions.ConnectionError):
+        return "🌐 **Connection Error** - Unable to reach the API. Check your internet connection."
+    elif isinstance(error, requests.exceptions.RequestException):
+        return f"🚫 **Request Failed** - {str(error)}"
+    else:
+        return f"❌ **Unexpected Error** - {str(error)}"
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def get_course_passages(slides_version: str) -> List[tuple]:
+    """(slide title, passage, trigram features) for every bullet and line of the slides"""
+    passages = []
+    for slide in get_slides():
+        for line in slide["content"].splitlines():
+            text = line.strip().lstrip("#*>-• ").replace("**", "").strip()
+            if len(text) > 20:
+                passages.append((slide["title"], text, question_features(text)))
+    return passages
+
+def trigram_similarity(a: Counter, b: Counter) -> float:
+    """Cosine similarity of two trigram count vectors"""
+    dot = sum(count * b[term] for term, count in a.items() if term in b)
+    norm = math.sqrt(sum(v * v for v in a.values())) * math.sqrt(sum(v * v for v in b.values()))
+    return dot / norm if norm else 0.0
+
+def degraded_specialist_answer(specialist_name: str, question: str) -> str:
+    """Answer from the course slides while the API is unavailable"""
+    features = question_features(question)
+    scored = sorted(
+        ((trigram_similarity(features, passage_features), title, text)
+         for title, text, passage_features in get_course_passages(content_version("slides"))),
+        reverse=True
+    )
+    related = [(title, text) for score, title, text in scored[:3] if score > 0.1]
+    message = ("📖 **Michigan State AI is temporarily unavailable** - "
+               f"{get_experts()[specialist_name]['name']} will be back shortly. ")
+    if not related:
+        return message + "Please try your question again in a minute."
+    return message + "Meanwhile, here is what the course slides say:\n\n" + "\n".join(
+        f"- **{title}:** {text}" for title, text in related
+    )
+
+def fetch_specialist_answer(api_key: str, specialist_name: str, question: str,
+                            resident_verified: bool, user_location: str = None,
+                            on_wait: Optional[Callable[[int, float], None]] = None,
+                            history: List[dict] = None) -> str:
+    """Cache-aware Messages API call that never touches session state (safe in worker threads)"""
+    data = build_specialist_request(specialist_name, question, resident_verified, user_location, history)
+    context = conversation_context_key(data)
+    
+    # Answers depend on the location hint and earlier turns too, so only
+    # standalone, location-free questions are shared
+    use_cache = not user_location and not context
+    started = time.perf_counter()
+    if use_cache:
+        cached = lookup_cached_answer(specialist_name, question, resident_verified, data["model"])
+        if cached is not None:
+            get_ai_metrics().record(specialist_name, "cached", "hit", time.perf_counter() - started,
+                                    ttft=time.perf_counter() - started)
+            return cached
+    
+    if get_circuit_breaker().is_open():
+        get_ai_metrics().record(specialist_name, "circuit_open", "miss" if use_cache else "bypass",
+                                time.perf_counter() - started)
+        return degraded_specialist_answer(specialist_name, question)
+    
+    # Identical questions already in flight share that call instead of starting another
+    key = specialist_flight_key(api_key, specialist_name, question, resident_verified,
+                                user_location, context)
+    return get_singleflight().do(key, lambda: request_specialist_answer(
+        api_key, specialist_name, question, resident_verified, data, use_cache, on_wait, started
+    ))
+
+def request_specialist_answer(api_key: str, specialist_name: str, question: str,
+                              resident_verified: bool, data: dict, use_cache: bool,
+                              on_wait: Optional[Callable[[int, float], None]] = None,
+                              started: Optional[float] = None) -> str:
+    """Make the upstream Messages API call and store a successful answer"""
+    started = started or time.perf_counter()
+    cache = "miss" if use_cache else "bypass"
+    # Make API call with proper error handling
+    try:
+        response = retry_on_standard_route(
+            send_hedged_request(api_key, data, specialist_name, on_wait), data,
+            lambda fallback: send_hedged_request(api_key, fallback, specialist_name, on_wait)
+        )
+        
+        if response.status_code == 200:
+            response_data = response_message(response)
+            usage = response_data.get("usage", {})
+            settle_usage(usage, response.token_estimate)
+            answer = response_data["content"][0]["text"]
+            record_api_call(specialist_name, started, "200", cache, response, usage)
+            if use_cache:
+                store_answer(specialist_name, question, resident_verified, data["model"], answer)
+            return answer
+        record_api_call(specialist_name, started, str(response.status_code), cache, response)
+        if response.status_code == 401:
+            get_key_validator().invalidate(api_key)
+        return api_status_message(response.status_code)
+    except CircuitOpenError:
+        record_api_call(specialist_name, started, "circuit_open", cache)
+        return degraded_specialist_answer(specialist_name, question)
+    except Exception as e:
+        record_api_call(specialist_name, started, type(e).__name__, cache)
+        return api_exception_message(e)
+
+def get_ai_specialist_response(specialist_name: str, question: str, user_location: str = None,
+                               on_wait: Optional[Callable[[int, float], None]] = None,
+                               history: List[dict] = None) -> str:
+    """Generate response from Michigan State AI using Claude API with enhanced error handling"""
+    
+    api_key = get_api_key()
+    problem = check_api_ready(api_key)
+    if problem:
+        return problem
+    
+    return fetch_specialist_answer(api_key, specialist_name, question,
+                                   st.session_state.resident_verified, user_location, on_wait, history)
+
+@st.cache_resource(show_spinner=False)
+def get_panel_executor() -> ThreadPoolExecutor:
+    """Process-wide thread pool for asking several experts at once"""
+    return ThreadPoolExecutor(max_workers=int(get_setting("PANEL_MAX_WORKERS", 12)),
+                              thread_name_prefix="expert-panel")
+
+def ask_expert_panel(question: str, expert_keys: List[str]):
+    """Ask every expert concurrently, yielding (expert_key, response) as each answer arrives"""
+    api_key = get_api_key()
+    problem = check_api_ready(api_key)
+    if problem:
+        for expert_key in expert_keys:
+            yield expert_key, problem
+        return
+    
+    resident = st.session_state.resident_verified
+    executor = get_panel_executor()
+    futures = {
+        executor.submit(fetch_specialist_answer, api_key, expert_key, question, resident): expert_key
+        for expert_key in expert_keys
+    }
+    for future in as_completed(futures):
+        try:
+            yield futures[future], future.result()
+        except Exception as e:
+            yield futures[future], api_exception_message(e)
+
+# 🧵 BACKGROUND AI JOBS
+class AIJobQueue:
+    """Bounded worker pool that runs expert questions off the Streamlit script thread"""
+
+    def __init__(self, workers: int, max_queued: int, retention_seconds: float = 3600):
+        self.workers = workers
+        self.retention_seconds = retention_seconds
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._busy = 0
+        self._busy_seconds = 0.0
+        self._started = time.monotonic()
+        self._stats = {'submitted': 0, 'completed': 0, 'rejected': 0}
+        for n in range(workers):
+            threading.Thread(target=self._work, name=f"ai-job-{n}", daemon=True).start()
+
+    def submit(self, fn: Callable[..., str], *args, report_wait: bool = False,
+               **meta) -> Optional[str]:
+        """Queue fn(*args) and return its job id, or None if the queue is full.
+        
+        With report_wait, fn is also passed on_wait=, which records the job's place
+        in the rate-limit queue (or a retry countdown) in its 'wait' entry.
+        """
+        job_id = uuid.uuid4().hex
+        job = dict(meta, id=job_id, status='queued', submitted=time.time(),
+                   started=None, finished=None, response=None, wait=None)
+        with self._lock:
+            self._expire_finished()
+            self._jobs[job_id] = job
+        try:
+            self._queue.put_nowait((job_id, fn, args, report_wait))
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job_id]
+                self._stats['rejected'] += 1
+            return None
+        with self._lock:
+            self._stats['submitted'] += 1
+        return job_id
+
+    def _work(self) -> None:
+        while True:
+            job_id, fn, args, report_wait = self._queue.get()
+            with self._lock:
+                self._busy += 1
+                self._jobs[job_id].update(status='running', started=time.time())
+            began = time.monotonic()
+            kwargs = {'on_wait': self._wait_reporter(job_id)} if report_wait else {}
+            try:
+                response = fn(*args, **kwargs)
+            except Exception as e:
+                response = api_exception_message(e)
+            with self._lock:
+                self._busy -= 1
+                self._busy_seconds += time.monotonic() - began
+                self._jobs[job_id].update(status='done', finished=time.time(), response=response)
+                self._stats['completed'] += 1
+
+    def _wait_reporter(self, job_id: str) -> Callable[[int, float], None]:
+        """on_wait callback that stores (position, deadline) on the job for the UI to poll"""
+        def report(position: int, seconds: float) -> None:
+            with self._lock:
+                if job_id in self._jobs:
+                    self._jobs[job_id]['wait'] = (position, time.time() + seconds)
+        return report
+
+    def _expire_finished(self) -> None:
+        """Drop results nobody collected (e.g. the session ended)"""
+        cutoff = time.time() - self.retention_seconds
+        for job_id in [j for j, job in self._jobs.items()
+                       if job['status'] == 'done' and job['finished'] < cutoff]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """Copy of a job's current state, or None if it is unknown"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def pop_finished(self, job_ids: List[str]) -> List[dict]:
+        """Remove and return the finished jobs among job_ids"""
+        with self._lock:
+            finished = [self._jobs.pop(j) for j in job_ids
+                        if j in self._jobs and self._jobs[j]['status'] == 'done']
+        return finished
+
+    def stats(self) -> dict:
+        """Queue depth and worker utilization"""
+        with self._lock:
+            uptime = time.monotonic() - self._started
+            stats = dict(self._stats)
+            stats.update(
+                queued=self._queue.qsize(),
+                running=self._busy,
+                workers=self.workers,
+                utilization=self._busy_seconds / (uptime * self.workers) if uptime else 0.0
+            )
+        return stats
+
+@st.cache_resource(show_spinner=False)
+def get_job_queue() -> AIJobQueue:
+    """Process-wide background job queue for expert questions"""
+    return AIJobQueue(
+        workers=int(get_setting("AI_JOB_WORKERS", 8)),
+        max_queued=int(get_setting("AI_JOB_MAX_QUEUED", 200))
+    )
+
+def submit_specialist_question(specialist_name: str, question: str,
+                               history: List[dict] = None) -> Optional[str]:
+    """Queue an expert question for this session; returns an error message if it can't be queued"""
+    api_key = get_api_key()
+    problem = check_api_ready(api_key)
+    if problem:
+        return problem
+    
+    resident = st.session_state.resident_verified
+    job_id = get_job_queue().submit(
+        lambda on_wait: fetch_specialist_answer(api_key, specialist_name, question, resident,
+                                                None, on_wait, history),
+        report_wait=True, expert_key=specialist_name, question=question
+    )
+    if job_id is None:
+        return "⏰ **Michigan State AI is at capacity** - Too many questions are waiting. Please try again shortly."
+    st.session_state.pending_jobs.append({'job_id': job_id, 'expert_key': specialist_name, 'question': question})
+    return None
+
+# 💬 SESSION CONVERSATION STORE
+# Plain dicts and lists so session state stays picklable. Each expert keeps its
+# newest turns in 'recent'; older ones wait in 'spill' and are then zlib-packed
+# in batches into 'archive'. 'bytes' tracks the session total against a cap.
+
+def conversation_size(conversation: dict) -> int:
+    return len(conversation['question']) + len(conversation['response']) + 64
+
+def get_conversation_store() -> dict:
+    """This session's conversation store (upgrading a legacy flat list in place)"""
+    store = st.session_state.ai_conversations
+    if isinstance(store, list):
+        legacy, store = store, {'next_seq': 0, 'experts': {}, 'bytes': 0}
+        st.session_state.ai_conversations = store
+        for conversation in legacy:
+            add_conversation(conversation)
+    return store
+
+def add_conversation(conversation: dict, persist: bool = True) -> None:
+    """Record a finished turn for this session, spilling and trimming to stay under the caps"""
+    store = get_conversation_store()
+    conversation = dict(conversation, seq=store['next_seq'])
+    store['next_seq'] += 1
+    if persist and st.session_state.get('student_id'):
+        get_progress_store().save_conversation(st.session_state.student_id, conversation)
+    expert = store['experts'].setdefault(conversation['expert'],
+                                         {'recent': [], 'spill': [], 'archive': [], 'dropped': 0})
+    expert['recent'].append(conversation)
+    store['bytes'] += conversation_size(conversation)
+    if 'conversation_search' in st.session_state:
+        index_conversation(st.session_state.conversation_search, conversation)
+    
+    if len(expert['recent']) > int(get_setting("CONVERSATION_RECENT_PER_EXPERT", 10)):
+        expert['spill'].append(expert['recent'].pop(0))
+    if len(expert['spill']) >= int(get_setting("CONVERSATION_SPILL_BATCH", 5)):
+        batch = expert['spill']
+        blob = zlib.compress(json.dumps(batch).encode("utf-8"))
+        expert['archive'].append({'seqs': [c['seq'] for c in batch], 'blob': blob})
+        expert['spill'] = []
+        store['bytes'] += len(blob) - sum(conversation_size(c) for c in batch)
+    
+    trim_conversation_store()
+
+def trim_conversation_store() -> None:
+    """Drop the oldest archived batches until the store and its search index fit the cap"""
+    store = get_conversation_store()
+    index = st.session_state.get('conversation_search')
+    max_bytes = int(get_setting("CONVERSATION_MAX_BYTES", 256 * 1024))
+    # Over the cap, the oldest archived batch of any expert goes first
+    while store['bytes'] + (index['bytes'] if index else 0) > max_bytes:
+        archived = [e for e in store['experts'].values() if e['archive']]
+        if not archived:
+            break
+        oldest = min(archived, key=lambda e: e['archive'][0]['seqs'][0])
+        batch = oldest['archive'].pop(0)
+        oldest['dropped'] += len(batch['seqs'])
+        store['bytes'] -= len(batch['blob'])
+        if index:
+            remove_conversation_docs(index, set(batch['seqs']))
+
+def recent_conversations(expert_name: str, limit: int) -> List[dict]:
+    """The newest turns with an expert, oldest first, without touching the archive"""
+    expert = get_conversation_store()['experts'].get(expert_name)
+    if expert is None:
+        return []
+    return (expert['spill'] + expert['recent'])[-limit:]
+
+def conversations_since(expert_name: str, seq: int) -> List[dict]:
+    """Every stored turn with an expert from sequence number seq on, oldest first"""
+    expert = get_conversation_store()['experts'].get(expert_name)
+    if expert is None:
+        return []
+    turns = []
+    for batch in expert['archive']:
+        if batch['seqs'][-1] >= seq:
+            turns.extend(json.loads(zlib.decompress(batch['blob'])))
+    turns.extend(expert['spill'] + expert['recent'])
+    return [turn for turn in turns if turn['seq'] >= seq]
+
+def count_conversations_since(expert_name: str, seq: int) -> int:
+    """Number of stored turns with an expert from seq on, without decompressing"""
+    expert = get_conversation_store()['experts'].get(expert_name)
+    if expert is None:
+        return 0
+    seqs = [s for batch in expert['archive'] if batch['seqs'][-1] >= seq for s in batch['seqs']]
+    seqs += [turn['seq'] for turn in expert['spill'] + expert['recent']]
+    return sum(s >= seq for s in seqs)
+
+def iter_conversations():
+    """Every stored turn of this session across experts, in the order they happened"""
+    store = get_conversation_store()
+    return iter(sorted(
+        (turn for name in store['experts'] for turn in conversations_since(name, 0)),
+        key=lambda turn: turn['seq']
+    ))
+
+def expert_history(expert_key: str) -> List[dict]:
+    """This session's turns with an expert since the student last started a new conversation"""
+    name = get_experts()[expert_key]['name']
+    return conversations_since(name, st.session_state.conversation_resets.get(expert_key, 0))
+
+# 🔍 COURSE SEARCH
+# BM25 over plain dicts: {'docs': [...], 'postings': {term: [(doc_id, tf)]}, 'total_length'}.
+# The course index is shared and rebuilt per content version; each session indexes
+# its own conversations as they are added, so its index can live in session state.
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+def search_terms(text: str) -> List[str]:
+    """Accent-folded, lower-cased word tokens without stopwords or a trailing plural s"""
+    folded = unicodedata.normalize("NFKD", text.lower()).encode("ascii", "ignore").decode("ascii")
+    terms = []
+    for word in re.findall(r"[a-z0-9]+", folded):
+        if word in QUESTION_STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+def new_search_index() -> dict:
+    return {'docs': [], 'postings': {}, 'total_length': 0, 'bytes': 0}
+
+def search_doc_size(doc: dict, postings: int) -> int:
+    """Rough serialized size of an indexed document, for the session memory cap"""
+    return len(doc['title']) + 64 + 16 * postings
+
+def index_document(index: dict, doc: dict, text: str) -> None:
+    """Add one document; its title is counted twice so title matches rank first"""
+    counts = Counter(search_terms(f"{doc['title']} {doc['title']} {text}"))
+    doc_id = len(index['docs'])
+    index['docs'].append(dict(doc, length=sum(counts.values()), postings=len(counts)))
+    index['total_length'] += index['docs'][-1]['length']
+    index['bytes'] += search_doc_size(doc, len(counts))
+    for term, tf in counts.items():
+        index['postings'].setdefault(term, []).append((doc_id, tf))
+
+def search_indexes(indexes: List[dict], query: str, limit: int) -> List[tuple]:
+    """(score, doc) best first, scoring several indexes as one collection"""
+    terms = set(search_terms(query))
+    doc_count = sum(len(index['docs']) for index in indexes)
+    if not terms or not doc_count:
+        return []
+    average_length = sum(index['total_length'] for index in indexes) / doc_count or 1.0
+    scores = defaultdict(float)
+    for term in terms:
+        postings = [(n, index['postings'].get(term, ())) for n, index in enumerate(indexes)]
+        doc_freq = sum(len(entries) for _, entries in postings)
+        if not doc_freq:
+            continue
+        idf = math.log(1 + (doc_count - doc_freq + 0.5) / (doc_freq + 0.5))
+        for n, entries in postings:
+            docs = indexes[n]['docs']
+            for doc_id, tf in entries:
+                norm = 1 - BM25_B + BM25_B * docs[doc_id]['length'] / average_length
+                scores[(n, doc_id)] += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * norm)
+    best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+    return [(score, indexes[n]['docs'][doc_id]) for (n, doc_id), score in best]
+
+def best_snippet(text: str, query: str, width: int = 220) -> str:
+    """The line or sentence of text sharing the most terms with the query"""
+    terms = set(search_terms(query))
+    pieces = [piece.strip().lstrip("#*>-• ").replace("**", "")
+              for piece in re.split(r"\n|(?<=[.!?])\s", text) if piece.strip()]
+    if not pieces:
+        return ""
+    best = max(pieces, key=lambda piece: len(terms.intersection(search_terms(piece))))
+    return best if len(best) <= width else best[:width].rsplit(" ", 1)[0] + "…"
+
+def course_search_version() -> str:
+    return "|".join(content_version(name) for name in ("slides", "quizzes", "resources"))
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def get_course_search_index(version: str) -> dict:
+    """Index over slides, quiz questions and resources, built once per content version"""
+    index = new_search_index()
+    for i, slide in enumerate(get_slides()):
+        timeline = "\n".join(f"{year}: {event}" for year, event in (slide.get("timeline") or {}).items())
+        text = "\n".join([slide["content"], slide.get("presenter_notes", ""), timeline])
+        index_document(index, {'kind': 'slide', 'title': slide["title"], 'text': text, 'slide': i}, text)
+    quizzes = get_quiz_data()
+    for quiz_id in quizzes:
+        quiz = quizzes[quiz_id]
+        for n, question in enumerate(quiz["questions"], 1):
+            text = f"{question['question']}\n{question['explanation']}"
+            index_document(index, {'kind': 'quiz', 'title': f"{quiz['title']} - Question {n}",
+                                   'text': text, 'quiz': quiz_id}, text)
+    for section, links in get_resources().items():
+        for link in links:
+            index_document(index, {'kind': 'resource', 'title': link["title"], 'text': link["description"],
+                                   'url': link["url"], 'section': section}, link["description"])
+    return index
+
+def index_conversation(index: dict, conversation: dict) -> None:
+    """Index a turn by reference; its text stays in the conversation store"""
+    index_document(index, {'kind': 'conversation', 'title': conversation['question'][:80],
+                           'expert': conversation['expert'], 'seq': conversation['seq']},
+                   f"{conversation['question']}\n{conversation['response']}")
+
+def remove_conversation_docs(index: dict, seqs: set) -> None:
+    """Drop the documents of trimmed turns, renumbering the rest in place"""
+    kept = [doc for doc in index['docs'] if doc['seq'] not in seqs]
+    if len(kept) == len(index['docs']):
+        return
+    renumber = {old: new for new, old in enumerate(
+        n for n, doc in enumerate(index['docs']) if doc['seq'] not in seqs
+    )}
+    postings = {}
+    for term, entries in index['postings'].items():
+        entries = [(renumber[doc_id], tf) for doc_id, tf in entries if doc_id in renumber]
+        if entries:
+            postings[term] = entries
+    index.update(docs=kept, postings=postings,
+                 total_length=sum(doc['length'] for doc in kept),
+                 bytes=sum(search_doc_size(doc, doc['postings']) for doc in kept))
+
+def get_conversation_search_index() -> dict:
+    """This session's index over its own conversations, built on its first search"""
+    index = st.session_state.get('conversation_search')
+    if index is None:
+        index = new_search_index()
+        for conversation in iter_conversations():
+            index_conversation(index, conversation)
+        st.session_state.conversation_search = index
+        # The index counts toward the session cap, so building it may trim old turns
+        trim_conversation_store()
+    return index
+
+def find_conversation(expert_name: str, seq: int) -> Optional[dict]:
+    """A stored turn by sequence number, or None once it has been trimmed"""
+    turns = conversations_since(expert_name, seq)
+    return turns[0] if turns and turns[0]['seq'] == seq else None
+
+# 🗄️ STUDENT PROGRESS PERSISTENCE
+class ProgressStore:
+    """SQLite (WAL) store for per-student progress with write-behind batching.
+    
+    Saves only enqueue; one writer thread commits them in batches, so the
+    rerun path never waits on disk. Loads read through a separate connection.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS students (
+            student_id TEXT PRIMARY KEY,
+            first_seen REAL NOT NULL,
+            last_seen REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS student_responses (
+            student_id TEXT NOT NULL,
+            response_key TEXT NOT NULL,
+            response TEXT NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (student_id, response_key)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS quiz_attempts (
+            student_id TEXT NOT NULL,
+            quiz_id TEXT NOT NULL,
+            submitted INTEGER NOT NULL,
+            score REAL NOT NULL,
+            answers TEXT NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (student_id, quiz_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS ai_conversations (
+            id INTEGER PRIMARY KEY,
+            student_id TEXT NOT NULL,
+            expert TEXT NOT NULL,
+            question TEXT NOT NULL,
+            response TEXT NOT NULL,
+            timestamp TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS ai_conversations_student ON ai_conversations (student_id, id);
+        CREATE INDEX IF NOT EXISTS quiz_attempts_quiz ON quiz_attempts (quiz_id, submitted);
+        CREATE INDEX IF NOT EXISTS ai_conversations_expert ON ai_conversations (expert, timestamp);
+    """
+
+    def __init__(self, path: str, flush_interval: float, batch_size: int):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        writer = sqlite3.connect(path, check_same_thread=False)
+        writer.execute("PRAGMA journal_mode=WAL")
+        # With WAL, NORMAL only syncs at checkpoints; a crash can lose the last batch, never corrupt
+        writer.execute("PRAGMA synchronous=NORMAL")
+        writer.executescript(self.SCHEMA)
+        writer.commit()
+        self._reader = sqlite3.connect(path, check_same_thread=False)
+        self._read_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._stats = {'queued': 0, 'written': 0, 'coalesced': 0, 'batches': 0, 'errors': 0}
+        threading.Thread(target=self._run, args=(writer,), name="his220-progress-writer",
+                         daemon=True).start()
+        atexit.register(self.flush)
+
+    def _enqueue(self, key: tuple, sql: str, params: tuple) -> None:
+        with self._lock:
+            self._stats['queued'] += 1
+        self._queue.put((key, sql, params))
+
+    def _run(self, conn: sqlite3.Connection) -> None:
+        while True:
+            first = self._queue.get()
+            # Give a burst of saves a moment to arrive so they share one commit
+            time.sleep(self.flush_interval)
+            items = [first]
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            batch, waiters = {}, []
+            for item in items:
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    # Only the latest save of the same row is written
+                    batch.pop(item[0], None)
+                    batch[item[0]] = item
+            try:
+                with conn:
+                    for key, sql, params in batch.values():
+                        conn.execute(sql, params)
+                with self._lock:
+                    self._stats['written'] += len(batch)
+                    self._stats['coalesced'] += len(items) - len(waiters) - len(batch)
+                    self._stats['batches'] += 1
+            except sqlite3.Error as e:
+                logger.error("progress batch of %s writes failed: %s", len(batch), e)
+                with self._lock:
+                    self._stats['errors'] += 1
+            for waiter in waiters:
+                waiter.set()
+
+    def touch_student(self, student_id: str) -> None:
+        now = time.time()
+        self._enqueue(("students", student_id), """
+            INSERT INTO students (student_id, first_seen, last_seen) VALUES (?, ?, ?)
+            ON CONFLICT (student_id) DO UPDATE SET last_seen = excluded.last_seen
+        """, (student_id, now, now))
+
+    def save_response(self, student_id: str, response_key: str, response: str) -> None:
+        self._enqueue(("responses", student_id, response_key), """
+            INSERT OR REPLACE INTO student_responses (student_id, response_key, response, updated_at)
+            VALUES (?, ?, ?, ?)
+        """, (student_id, response_key, response, time.time()))
+
+    def save_quiz(self, student_id: str, quiz_id: str, quiz_state: dict) -> None:
+        self._enqueue(("quiz", student_id, quiz_id), """
+            INSERT OR REPLACE INTO quiz_attempts (student_id, quiz_id, submitted, score, answers, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (student_id, quiz_id, int(quiz_state['submitted']), quiz_state['score'],
+              json.dumps(quiz_state['answers']), time.time()))
+
+    def save_conversation(self, student_id: str, conversation: dict) -> None:
+        # Appended, never replaced: two tabs with the same ID must not overwrite each other
+        self._enqueue(("conversation", uuid.uuid4().hex), """
+            INSERT INTO ai_conversations (student_id, expert, question, response, timestamp)
+            VALUES (?, ?, ?, ?, ?)
+        """, (student_id, conversation['expert'], conversation['question'],
+              conversation['response'], conversation['timestamp']))
+
+    def has_student(self, student_id: str) -> bool:
+        """Whether any progress has been saved under this key"""
+        with self._read_lock:
+            return self._reader.execute(
+                "SELECT 1 FROM students WHERE student_id = ?", (student_id,)
+            ).fetchone() is not None
+
+    def load(self, student_id: str, max_conversations: int = 200) -> dict:
+        """Everything saved for a student, shaped like the session state keys"""
+        with self._read_lock:
+            responses = dict(self._reader.execute(
+                "SELECT response_key, response FROM student_responses WHERE student_id = ?", (student_id,)
+            ).fetchall())
+            quizzes = {
+                quiz_id: {'answers': {int(i): a for i, a in json.loads(answers).items()},
+                          'submitted': bool(submitted), 'score': score}
+                for quiz_id, submitted, score, answers in self._reader.execute(
+                    "SELECT quiz_id, submitted, score, answers FROM quiz_attempts WHERE student_id = ?",
+                    (student_id,)
+                )
+            }
+            conversations = self._reader.execute("""
+                SELECT expert, question, response, timestamp FROM ai_conversations
+                WHERE student_id = ? ORDER BY id DESC LIMIT ?
+            """, (student_id, max_conversations)).fetchall()
+        return {
+            'student_responses': responses,
+            'quiz_attempts': quizzes,
+            'ai_conversations': [
+                {'expert': expert, 'question': question, 'response': response, 'timestamp': timestamp}
+                for expert, question, response, timestamp in reversed(conversations)
+            ]
         }
-    ]
-}
 
-def test_api_key():
-    """Test if the API key works with a simple request"""
-    api_key = get_api_key()
-    if not api_key:
-        return False, "No API key provided"
-    
-    headers = {
-        "x-api-key": api_key,
-        "Content-Type": "application/json",
-        "anthropic-version": "2023-06-01"
-    }
-    
-    test_data = {
-        "model": "claude-3-haiku-20240307",
-        "max_tokens": 10,
-        "messages": [{"role": "user", "content": "Hello"}]
-    }
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait until everything queued so far is committed"""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats['pending'] = self._queue.qsize()
+        return stats
+
+@st.cache_resource(show_spinner=False)
+def get_progress_store() -> ProgressStore:
+    """Process-wide student progress store"""
+    return ProgressStore(
+        path=get_setting("PROGRESS_DB_PATH", os.path.join(DATA_DIR, "progress.sqlite3")),
+        flush_interval=float(get_setting("PROGRESS_FLUSH_SECONDS", 0.5)),
+        batch_size=int(get_setting("PROGRESS_BATCH_SIZE", 500))
+    )
+
+# Progress is keyed on a random resume code the server hands out, never on a
+# name or ID a classmate could guess. Only a hash of the code is stored.
+RESUME_CODE_ALPHABET = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"  # no 0/O or 1/I
+
+def new_resume_code() -> str:
+    """Random 12-character code (about 60 bits), grouped for reading aloud"""
+    code = "".join(secrets.choice(RESUME_CODE_ALPHABET) for _ in range(12))
+    return "-".join(code[i:i + 4] for i in range(0, 12, 4))
+
+def normalize_resume_code(code: str) -> str:
+    """Uppercase and regroup a typed code; "" if it cannot be one we issued"""
+    code = re.sub(r"[^A-Z0-9]", "", code.upper())
+    if len(code) != 12 or any(c not in RESUME_CODE_ALPHABET for c in code):
+        return ""
+    return "-".join(code[i:i + 4] for i in range(0, 12, 4))
+
+def resume_code_key(code: str) -> str:
+    """Storage key for a resume code"""
+    return hashlib.sha256(f"his220-progress:{code}".encode("utf-8")).hexdigest()
+
+def hydrate_student_progress(student_id: str) -> None:
+    """Load a student's saved progress into this session (once per student per session)"""
+    if st.session_state.get('hydrated_student') == student_id:
+        return
+    if st.session_state.get('hydrated_student'):
+        # Switching IDs mid-session must not carry the previous student's work over,
+        # including answers still being generated for them
+        for key in ('student_responses', 'quiz_attempts', 'assignment_progress',
+                    'ai_conversations', 'conversation_resets', 'pending_jobs'):
+            del st.session_state[key]
+        st.session_state.pop('conversation_search', None)
+        for key in [k for k in st.session_state if str(k).startswith("response_")
+                    or any(str(k).startswith(f"{quiz_id}_q") for quiz_id in get_quiz_data())]:
+            del st.session_state[key]
+        initialize_session_state()
+    store = get_progress_store()
+    saved = store.load(student_id)
+    store.touch_student(student_id)
     
-    try:
-        response = requests.post(
-            "https://api.anthropic.com/v1/messages",
-            headers=headers,
-            json=test_data,
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            return True, "API key working"
-        elif response.status_code == 401:
-            return False, "Invalid API key"
-        elif response.status_code == 429:
-            return False, "Rate limited"
+    st.session_state.student_responses.update(saved['student_responses'])
+    for response_key, response in saved['student_responses'].items():
+        st.session_state[response_key] = response  # prefill the slide's text area
+    quizzes = get_quiz_data()
+    for quiz_id, quiz_state in saved['quiz_attempts'].items():
+        st.session_state.quiz_attempts[quiz_id] = quiz_state
+        # A quiz edited since the attempt may no longer have the saved question or option
+        questions = quizzes[quiz_id]['questions'] if quiz_id in quizzes else ()
+        for i, answer in quiz_state['answers'].items():
+            if i < len(questions) and answer < len(questions[i]['options']):
+                st.session_state[f"{quiz_id}_q{i}"] = questions[i]['options'][answer]
+    for conversation in saved['ai_conversations']:
+        add_conversation(conversation, persist=False)
+    st.session_state.hydrated_student = student_id
+
+def start_saving_progress() -> None:
+    """Button callback that issues a new resume code for this session's work"""
+    code = new_resume_code()
+    st.session_state.resume_code = code
+    st.session_state.student_id = resume_code_key(code)
+    st.session_state.resume_error = None
+    # Save what the student has done so far under the new code
+    store = get_progress_store()
+    store.touch_student(st.session_state.student_id)
+    for response_key, response in st.session_state.student_responses.items():
+        store.save_response(st.session_state.student_id, response_key, response)
+    for quiz_id, quiz_state in st.session_state.quiz_attempts.items():
+        store.save_quiz(st.session_state.student_id, quiz_id, quiz_state)
+    for conversation in iter_conversations():
+        store.save_conversation(st.session_state.student_id, conversation)
+    st.session_state.hydrated_student = st.session_state.student_id
+    store.flush(timeout=1.0)
+
+def resume_progress() -> None:
+    """Button callback that switches this session to the progress saved under a typed code"""
+    code = normalize_resume_code(st.session_state.resume_code_input)
+    key = resume_code_key(code) if code else None
+    if key is None or not get_progress_store().has_student(key):
+        st.session_state.resume_error = "That resume code doesn't match any saved progress."
+        return
+    st.session_state.resume_code = code
+    st.session_state.student_id = key
+    st.session_state.resume_error = None
+    st.session_state.resume_code_input = ""
+
+def render_progress_controls() -> None:
+    """Sidebar resume code: progress is saved and restored under a code the server issues"""
+    # Links from before resume codes carried the ID in the URL; drop it rather than keep it shareable
+    if "student" in st.query_params:
+        del st.query_params["student"]
+    code = st.session_state.get('resume_code')
+    with st.sidebar.expander("💾 Save your progress", expanded=not code):
+        if code:
+            st.markdown(f"Resume code: **`{code}`**")
+            st.caption("Enter it on any device to pick up where you left off. "
+                       "Keep it private: anyone with the code can open your work.")
         else:
-            return False, f"HTTP {response.status_code}"
-    except Exception as e:
-        return False, f"Connection error: {str(e)}"
+            st.button("Start saving my progress", key="start_saving", on_click=start_saving_progress)
+        st.text_input("Resume code", key="resume_code_input", placeholder="ABCD-EFGH-JKLM")
+        st.button("Resume", key="resume_progress", on_click=resume_progress)
+        if st.session_state.get('resume_error'):
+            st.error(st.session_state.resume_error)
+    if st.session_state.get('student_id'):
+        hydrate_student_progress(st.session_state.student_id)
 
-def get_ai_specialist_response(specialist_name: str, question: str, user_location: str = None) -> str:
-    """Generate response from Michigan State AI using Claude API with enhanced error handling"""
+def save_student_response(response_key: str, response: str) -> None:
+    st.session_state.student_responses[response_key] = response
+    if st.session_state.get('student_id'):
+        get_progress_store().save_response(st.session_state.student_id, response_key, response)
+
+def save_quiz_attempt(quiz_id: str) -> None:
+    if st.session_state.get('student_id'):
+        get_progress_store().save_quiz(st.session_state.student_id, quiz_id,
+                                       st.session_state.quiz_attempts[quiz_id])
+
+def collect_finished_jobs() -> int:
+    """Move this session's finished background answers into the conversation store"""
+    pending = st.session_state.pending_jobs
+    if not pending:
+        return 0
+    jobs = get_job_queue()
+    finished = {job['id']: job for job in jobs.pop_finished([p['job_id'] for p in pending])}
+    still_pending = []
+    for entry in pending:
+        job = finished.get(entry['job_id'])
+        if job is None and jobs.get(entry['job_id']) is not None:
+            still_pending.append(entry)
+            continue
+        # Unknown ids were lost, e.g. the server restarted while they were queued
+        response = job['response'] if job else "🚫 **Request Lost** - Please ask your question again."
+        finished_at = datetime.fromtimestamp(job['finished']) if job else datetime.now()
+        add_conversation({
+            'expert': get_experts()[entry['expert_key']]['name'],
+            'question': entry['question'],
+            'response': response,
+            'timestamp': finished_at.strftime("%Y-%m-%d %H:%M:%S")
+        })
+    st.session_state.pending_jobs = still_pending
+    return len(pending) - len(still_pending)
+
+def iter_sse_events(response: requests.Response):
+    """Yield (event, data) pairs from a server-sent events response"""
+    event, data_lines = None, []
+    for line in response.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if line == "":
+            if data_lines:
+                yield event, json.loads("\n".join(data_lines))
+            event, data_lines = None, []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data_lines.append(line[len("data:"):].strip())
+    if data_lines:
+        yield event, json.loads("\n".join(data_lines))
+
+def stream_ai_specialist_response(specialist_name: str, question: str, user_location: str = None,
+                                  on_wait: Optional[Callable[[int, float], None]] = None,
+                                  history: List[dict] = None):
+    """Stream a Michigan State AI response token by token (for st.write_stream)"""
     
     api_key = get_api_key()
-    if not api_key:
-        return """🔑 **API Key Missing**
-        
-No Anthropic API key found. Please add your API key to Streamlit secrets as `ANTHROPIC_API_KEY` or enter it in the sidebar for testing.
-
-To get an API key:
-1. Go to console.anthropic.com
-2. Create an account
-3. Generate an API key
-4. Add it to your Streamlit secrets"""
+    problem = check_api_ready(api_key)
+    if problem:
+        yield problem
+        return
     
-    # Test API key first time
-    if st.session_state.api_test_result is None:
-        working, message = test_api_key()
-        st.session_state.api_test_result = (working, message)
+    resident = st.session_state.resident_verified
+    data = build_specialist_request(specialist_name, question, resident, user_location, history)
+    data["stream"] = True
+    context = conversation_context_key(data)
     
-    if not st.session_state.api_test_result[0]:
-        return f"""❌ **API Key Issue**
-        
-{st.session_state.api_test_result[1]}
-
-Please check your API key and try again. Make sure:
-- Key starts with 'sk-ant-api03-'
-- Key is active and has credits
-- No extra spaces or characters"""
+    use_cache = not user_location and not context
+    started = time.perf_counter()
+    if use_cache:
+        cached = lookup_cached_answer(specialist_name, question, resident, data["model"])
+        if cached is not None:
+            get_ai_metrics().record(specialist_name, "cached", "hit", time.perf_counter() - started,
+                                    ttft=time.perf_counter() - started)
+            yield cached
+            return
     
-    # Build the system prompt
-    specialist = MICHIGAN_AI_EXPERTS[specialist_name]
+    if get_circuit_breaker().is_open():
+        get_ai_metrics().record(specialist_name, "circuit_open", "miss" if use_cache else "bypass",
+                                time.perf_counter() - started)
+        yield degraded_specialist_answer(specialist_name, question)
+        return
     
-    resident_context = ""
-    if st.session_state.resident_verified:
-        resident_context = f"""
-IMPORTANT: This user is a verified Michigan resident. {specialist['resident_focus']}
+    # A question already in flight is shared; its waiters receive the finished text at once
+    key = specialist_flight_key(api_key, specialist_name, question, resident, user_location, context)
+    flight = get_singleflight()
+    leader, call = flight.begin(key)
+    if not leader:
+        shared = flight.wait(call)
+        if shared is not None:
+            yield shared
+            return
+    
+    parts, completed = [], False
+    try:
+        for part in stream_specialist_chunks(api_key, specialist_name, question, resident,
+                                             data, use_cache, on_wait, started):
+            parts.append(part)
+            yield part
+        completed = True
+    finally:
+        if leader:
+            flight.finish(key, call, "".join(parts) if completed else None)
 
-Provide practical, actionable information that helps them as a Michigan resident. Connect historical knowledge to current opportunities, challenges, and resources available in Michigan.
-"""
+def stream_specialist_chunks(api_key: str, specialist_name: str, question: str,
+                             resident_verified: bool, data: dict, use_cache: bool,
+                             on_wait: Optional[Callable[[int, float], None]] = None,
+                             started: Optional[float] = None):
+    """Make the upstream streaming call, yielding text deltas and storing the finished answer"""
+    started = started or time.perf_counter()
+    cache = "miss" if use_cache else "bypass"
+    chunks = []
+    usage = {}
+    first_token = None
+    response = None
+    try:
+        response = retry_on_standard_route(
+            send_messages_request(api_key, data, stream=True, on_wait=on_wait), data,
+            lambda fallback: send_messages_request(api_key, fallback, stream=True, on_wait=on_wait)
+        )
+        with response:
+            if response.status_code != 200:
+                record_api_call(specialist_name, started, str(response.status_code), cache, response)
+                if response.status_code == 401:
+                    get_key_validator().invalidate(api_key)
+                yield api_status_message(response.status_code)
+                return
+            
+            for event, payload in iter_sse_events(response):
+                if event == "content_block_delta" and payload["delta"].get("type") == "text_delta":
+                    if first_token is None:
+                        first_token = time.perf_counter()
+                    chunks.append(payload["delta"]["text"])
+                    yield payload["delta"]["text"]
+                elif event == "message_start":
+                    usage.update(payload["message"].get("usage", {}))
+                elif event == "message_delta":
+                    usage.update(payload.get("usage", {}))
+                elif event == "error":
+                    error = payload.get("error", {})
+                    record_api_call(specialist_name, started, error.get("type", "stream_error"),
+                                    cache, response, usage)
+                    yield f"\n\n🚫 **API Error** - {error.get('message', 'stream interrupted')}"
+                    return
+    except CircuitOpenError:
+        record_api_call(specialist_name, started, "circuit_open", cache)
+        yield degraded_specialist_answer(specialist_name, question)
+        return
+    except Exception as e:
+        record_api_call(specialist_name, started, type(e).__name__, cache, response, usage)
+        yield api_exception_message(e)
+        return
     
-    system_prompt = f"""You are {specialist['name']}, {specialist['title']}.
+    settle_usage(usage, response.token_estimate)
+    record_api_call(specialist_name, started, "200", cache, response, usage, first_token)
+    if use_cache and chunks:
+        store_answer(specialist_name, question, resident_verified, data["model"], "".join(chunks))
 
-Background: {specialist['background']}
+# 📤 METRICS EXPORT
+def render_prometheus_metrics() -> str:
+    """AI call metrics plus process-wide queue and cache gauges, in Prometheus text format"""
+    lines = get_ai_metrics().prometheus_lines()
+    gauges = [
+        ("his220_ai_jobs_queued", "gauge", "Background AI questions waiting for a worker",
+         get_job_queue().stats()['queued']),
+        ("his220_ai_jobs_running", "gauge", "Background AI questions being answered",
+         get_job_queue().stats()['running']),
+        ("his220_rate_limit_waiting", "gauge", "Callers waiting in the shared rate limiter",
+         get_rate_limiter().stats()['waiting']),
+        ("his220_circuit_open", "gauge", "1 while the API circuit breaker is refusing calls",
+         int(get_circuit_breaker().is_open())),
+        ("his220_circuit_opened_total", "counter", "Times the API circuit breaker has opened",
+         get_circuit_breaker().stats()['opened']),
+        ("his220_ai_hedges_total", "counter", "Duplicate requests sent for calls slower than p95",
+         get_request_hedger().stats()['hedges']),
+        ("his220_ai_hedge_wins_total", "counter", "Hedged calls answered by the duplicate request",
+         get_request_hedger().stats()['hedge_wins']),
+        ("his220_progress_writes_pending", "gauge", "Student progress saves waiting for the next batch",
+         get_progress_store().stats()['pending']),
+        ("his220_progress_writes_total", "counter", "Student progress rows committed",
+         get_progress_store().stats()['written']),
+        ("his220_coalesced_calls_total", "counter", "Upstream calls saved by sharing identical questions",
+         get_singleflight().stats()['coalesced']),
+        ("his220_answer_cache_hits_total", "counter", "Shared answer cache hits",
+         get_answer_cache().stats()['hits']),
+        ("his220_answer_cache_misses_total", "counter", "Shared answer cache misses",
+         get_answer_cache().stats()['misses']),
+        ("his220_prompt_tokens_uncached_total", "counter", "Prompt tokens billed at the full input rate",
+         get_prompt_cache_stats().stats()['input_tokens']),
+        ("his220_prompt_cache_read_tokens_total", "counter", "Prompt tokens read from the prompt cache",
+         get_prompt_cache_stats().stats()['cache_read_input_tokens']),
+        ("his220_prompt_cache_write_tokens_total", "counter", "Prompt tokens written to the prompt cache",
+         get_prompt_cache_stats().stats()['cache_creation_input_tokens']),
+        ("his220_prompt_cache_read_ratio", "gauge", "Share of prompt tokens read from the prompt cache",
+         get_prompt_cache_stats().stats()['cached_share'])
+    ]
+    for name, kind, help_text, value in gauges:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {value}"]
+    lines += ["# HELP his220_ai_routed_total Questions routed to each model tier",
+              "# TYPE his220_ai_routed_total counter"]
+    for tier, count in sorted(get_question_router().stats().items()):
+        lines.append(f'his220_ai_routed_total{{tier="{tier}"}} {count}')
+    return "\n".join(lines) + "\n"
 
-Your expertise areas:
-{chr(10).join(f"- {area}" for area in specialist['key_areas'])}
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Serve GET /metrics for a Prometheus scraper"""
 
-Your personality: {specialist['personality']}
+    def log_message(self, format, *args):
+        pass
 
-{resident_context}
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
 
-Respond as this specialist, providing educational content that helps the user understand Michigan history and its relevance today. Be helpful, knowledgeable, and encouraging. Keep responses to 2-3 paragraphs unless the question requires more detail."""
+def write_metrics_file(path: str, interval: float) -> None:
+    """Rewrite a textfile-collector scrape file every interval seconds"""
+    while True:
+        try:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(render_prometheus_metrics())
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("could not write metrics file %s: %s", path, e)
+        time.sleep(interval)
 
-    user_message = f"As a Michigan history specialist, can you help me with this question: {question}"
-    if user_location:
-        user_message += f" (I'm asking from {user_location})"
-    
-    # Make API call with proper error handling
-    headers = {
-        "x-api-key": api_key,
-        "Content-Type": "application/json", 
-        "anthropic-version": "2023-06-01"
-    }
-    
-    data = {
-        "model": "claude-3-haiku-20240307",
-        "max_tokens": 500,
-        "system": system_prompt,
-        "messages": [
-            {"role": "user", "content": user_message}
-        ]
+@st.cache_resource(show_spinner=False)
+def start_metrics_exporter() -> dict:
+    """Start the opt-in Prometheus endpoint (METRICS_PORT) and scrape file (METRICS_FILE) once per process"""
+    exporters = {}
+    port = get_setting("METRICS_PORT")
+    if port:
+        try:
+            server = ThreadingHTTPServer((get_setting("METRICS_HOST", "127.0.0.1"), int(port)),
+                                         MetricsRequestHandler)
+        except OSError as e:
+            # Raising here would re-raise on every rerun, since cache_resource keeps no failures
+            logger.error("metrics endpoint not started on port %s: %s", port, e)
+        else:
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name="his220-metrics-http", daemon=True).start()
+            exporters['port'] = server.server_address[1]
+    path = get_setting("METRICS_FILE")
+    if path:
+        interval = float(get_setting("METRICS_FILE_INTERVAL_SECONDS", 15))
+        threading.Thread(target=write_metrics_file, args=(path, interval),
+                         name="his220-metrics-file", daemon=True).start()
+        exporters['file'] = path
+    return exporters
+
+# 🎞️ SLIDE RENDERING
+# Static so it is identical for every slide; each slide sets --slide-bg inline
+SLIDE_CSS = (
+    "<style>"
+    ".slide-container{background:linear-gradient(135deg,var(--slide-bg,#fff) 0%,#fff 100%);"
+    "padding:2rem;border-radius:15px;box-shadow:0 8px 25px rgba(0,0,0,.1);margin:1rem 0;"
+    "animation:slideIn .8s ease-out}"
+    "@keyframes slideIn{from{opacity:0;transform:translateY(30px)}to{opacity:1;transform:translateY(0)}}"
+    ".timeline-item{background:rgba(255,255,255,.8);padding:1rem;margin:.5rem 0;"
+    "border-left:4px solid #4a90e2;border-radius:5px}"
+    ".resource-item{background:rgba(0,123,255,.1);padding:1rem;margin:.5rem 0;border-radius:8px;"
+    "border:1px solid rgba(0,123,255,.2)}"
+    "</style>"
+)
+
+def build_slide_bundle(slide_data: dict) -> dict:
+    """Pre-render a slide's static markdown/HTML into as few elements as possible"""
+    bundle = {
+        'opening': (f'<div class="slide-container" '
+                    f'style="--slide-bg:{slide_data.get("background_color", "#ffffff")}">'),
+        'content': textwrap.dedent(slide_data["content"]).strip(),
+        'timeline': None,
+        'great_lakes': None,
+        'resources': None
     }
-    
-    try:
-        response = requests.post(
-            "https://api.anthropic.com/v1/messages",
-            headers=headers,
-            json=data,
-            timeout=30
+    if slide_data.get("timeline"):
+        bundle['timeline'] = "### 📅 Historical Timeline\n" + "\n".join(
+            f'<div class="timeline-item"><strong>{year}:</strong> {event}</div>'
+            for year, event in slide_data["timeline"].items()
         )
-        
-        if response.status_code == 200:
-            response_data = response.json()
-            return response_data["content"][0]["text"]
-        elif response.status_code == 401:
-            st.session_state.api_test_result = (False, "Invalid API key")
-            return "🔑 **Authentication Failed** - Your API key is invalid or expired."
-        elif response.status_code == 429:
-            return "⏰ **Rate Limited** - Too many requests. Please wait a moment and try again."
-        elif response.status_code == 400:
-            return "❌ **Bad Request** - There was an issue with the request format."
-        else:
-            return f"🚫 **API Error** - HTTP {response.status_code}. Please try again."
-            
-    except requests.exceptions.Timeout:
-        return "⏰ **Timeout** - The request took too long. Please try again."
-    except requests.exceptions.ConnectionError:
-        return "🌐 **Connection Error** - Unable to reach the API. Check your internet connection."
-    except requests.exceptions.RequestException as e:
-        return f"🚫 **Request Failed** - {str(e)}"
-    except Exception as e:
-        return f"❌ **Unexpected Error** - {str(e)}"
+    if slide_data.get("map_data"):
+        bundle['great_lakes'] = "**Great Lakes:**\n\n" + "  \n".join(
+            f"• {lake}" for lake in slide_data["map_data"]["great_lakes"]
+        )
+        bundle['resources'] = "**Natural Resources:**\n\n" + "  \n".join(
+            f"• {resource}" for resource in slide_data["map_data"]["resources"]
+        )
+    return bundle
+
+class SlideBundleCache:
+    """Process-wide pre-rendered slide bundles, by slide id.
+    
+    The content pack replaces a slide's frozen object only when its file is
+    reloaded, so an identity check finds edited slides without hashing them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bundles = {}
+
+    def get(self, slide_data: Mapping) -> dict:
+        entry = self._bundles.get(slide_data["id"])
+        if entry is not None and entry[0] is slide_data:
+            return entry[1]
+        bundle = build_slide_bundle(slide_data)
+        with self._lock:
+            self._bundles[slide_data["id"]] = (slide_data, bundle)
+        return bundle
+
+@st.cache_resource(show_spinner=False)
+def get_slide_render_cache() -> SlideBundleCache:
+    """Process-wide slide bundle cache"""
+    return SlideBundleCache()
+
+def get_slide_bundle(slide_data: Mapping) -> dict:
+    """Cached bundle for the slide's current content; edited slides render afresh"""
+    return get_slide_render_cache().get(slide_data)
+
+def inject_slide_css() -> None:
+    """Emit the shared slide stylesheet; Streamlit drops elements a full rerun does not
+    re-emit, so this runs once per full run of the slides page, not once per slide"""
+    st.markdown(SLIDE_CSS, unsafe_allow_html=True)
 
 def create_interactive_slide(slide_data: dict) -> None:
     """Create an interactive slide with animations and enhanced visuals"""
-    
-    # Custom CSS for this slide
-    bg_color = slide_data.get('background_color', '#ffffff')
-    
-    st.markdown(f"""
-    <style>
-    .slide-container {{
-        background: linear-gradient(135deg, {bg_color} 0%, #ffffff 100%);
-        padding: 2rem;
-        border-radius: 15px;
-        box-shadow: 0 8px 25px rgba(0,0,0,0.1);
-        margin: 1rem 0;
-        animation: slideIn 0.8s ease-out;
-    }}
-    
-    @keyframes slideIn {{
-        from {{
-            opacity: 0;
-            transform: translateY(30px);
-        }}
-        to {{
-            opacity: 1;
-            transform: translateY(0);
-        }}
-    }}
-    
-    .timeline-item {{
-        background: rgba(255,255,255,0.8);
-        padding: 1rem;
-        margin: 0.5rem 0;
-        border-left: 4px solid #4a90e2;
-        border-radius: 5px;
-    }}
-    
-    .resource-item {{
-        background: rgba(0,123,255,0.1);
-        padding: 1rem;
-        margin: 0.5rem 0;
-        border-radius: 8px;
-        border: 1px solid rgba(0,123,255,0.2);
-    }}
-    </style>
-    """, unsafe_allow_html=True)
+    bundle = get_slide_bundle(slide_data)
     
     # Main slide content in container
-    st.markdown('<div class="slide-container">', unsafe_allow_html=True)
+    st.markdown(bundle['opening'], unsafe_allow_html=True)
     
     # Display main content
-    st.markdown(slide_data["content"])
+    st.markdown(bundle['content'])
     
     # Add interactive elements based on slide type
-    if slide_data.get("timeline"):
-        st.markdown("### 📅 Historical Timeline")
-        for year, event in slide_data["timeline"].items():
-            st.markdown(f'<div class="timeline-item"><strong>{year}:</strong> {event}</div>', 
-                       unsafe_allow_html=True)
+    if bundle['timeline']:
+        st.markdown(bundle['timeline'], unsafe_allow_html=True)
     
-    if slide_data.get("map_data"):
+    if bundle['great_lakes']:
         st.markdown("### 🗺️ Interactive Elements")
         col1, col2 = st.columns(2)
         
         with col1:
-            st.markdown("**Great Lakes:**")
-            for lake in slide_data["map_data"]["great_lakes"]:
-                st.markdown(f"• {lake}")
+            st.markdown(bundle['great_lakes'])
         
         with col2:
-            st.markdown("**Natural Resources:**")
-            for resource in slide_data["map_data"]["resources"]:
-                st.markdown(f"• {resource}")
+            st.markdown(bundle['resources'])
     
     # Interactive discussion prompt
     if slide_data.get("interactive") and slide_data.get("discussion_prompt"):
@@ -628,11 +3051,61 @@ def create_interactive_slide(slide_data: dict) -> None:
             height=100
         )
         if response:
-            st.session_state.student_responses[response_key] = response
+            if st.session_state.student_responses.get(response_key) != response:
+                save_student_response(response_key, response)
             st.success("Response saved!")
     
     st.markdown('</div>', unsafe_allow_html=True)
 
+def render_ai_status_card(api_key: str) -> Optional[tuple]:
+    """Render the Michigan State AI status card without waiting on the key check"""
+    if not api_key:
+        st.markdown("""
+        <div style="background: linear-gradient(45deg, #ff6b6b, #ee5a24); color: white; padding: 1.5rem; border-radius: 15px; text-align: center;">
+            <h3>❌</h3>
+            <p>AI Setup Needed</p>
+        </div>
+        """, unsafe_allow_html=True)
+        return False, "No API key provided"
+    
+    status = get_key_validator().peek(api_key)
+    if status is None:
+        st.markdown("""
+        <div style="background: linear-gradient(45deg, #a1c4fd, #c2e9fb); color: white; padding: 1.5rem; border-radius: 15px; text-align: center;">
+            <h3>⏳</h3>
+            <p>Checking Michigan State AI...</p>
+        </div>
+        """, unsafe_allow_html=True)
+    elif status[0]:
+        st.markdown("""
+        <div style="background: linear-gradient(45deg, #4facfe, #00f2fe); color: white; padding: 1.5rem; border-radius: 15px; text-align: center;">
+            <h3>✅</h3>
+            <p>Michigan State AI</p>
+        </div>
+        """, unsafe_allow_html=True)
+    elif status[0] is None:
+        st.markdown("""
+        <div style="background: linear-gradient(45deg, #f6d365, #fda085); color: white; padding: 1.5rem; border-radius: 15px; text-align: center;">
+            <h3>🌐</h3>
+            <p>Reconnecting...</p>
+        </div>
+        """, unsafe_allow_html=True)
+    else:
+        st.markdown("""
+        <div style="background: linear-gradient(45deg, #ff6b6b, #ee5a24); color: white; padding: 1.5rem; border-radius: 15px; text-align: center;">
+            <h3>⚠️</h3>
+            <p>AI Setup Needed</p>
+        </div>
+        """, unsafe_allow_html=True)
+    return status
+
+@st.fragment(run_every=1)
+def poll_ai_status_card(api_key: str) -> None:
+    """Re-render only the status card each second until the background check reports"""
+    if render_ai_status_card(api_key) is not None:
+        # One full rerun so the sidebar picks up the result and polling stops
+        st.rerun()
+
 def display_course_dashboard():
     """Enhanced course dashboard with Michigan State AI status"""
     st.markdown("# 🏛️ Michigan History HIS 220")
@@ -666,35 +3139,12 @@ def display_course_dashboard():
         """, unsafe_allow_html=True)
     
     with col4:
-        # Enhanced Michigan State AI status with real testing
+        # Michigan State AI status fills in from the shared background key check
         api_key = get_api_key()
-        if api_key:
-            if st.session_state.api_test_result is None:
-                with st.spinner("Testing Michigan State AI..."):
-                    working, message = test_api_key()
-                    st.session_state.api_test_result = (working, message)
-            
-            if st.session_state.api_test_result[0]:
-                st.markdown("""
-                <div style="background: linear-gradient(45deg, #4facfe, #00f2fe); color: white; padding: 1.5rem; border-radius: 15px; text-align: center;">
-                    <h3>✅</h3>
-                    <p>Michigan State AI</p>
-                </div>
-                """, unsafe_allow_html=True)
-            else:
-                st.markdown("""
-                <div style="background: linear-gradient(45deg, #ff6b6b, #ee5a24); color: white; padding: 1.5rem; border-radius: 15px; text-align: center;">
-                    <h3>⚠️</h3>
-                    <p>AI Setup Needed</p>
-                </div>
-                """, unsafe_allow_html=True)
+        if api_key and get_key_validator().peek(api_key) is None:
+            poll_ai_status_card(api_key)
         else:
-            st.markdown("""
-            <div style="background: linear-gradient(45deg, #ff6b6b, #ee5a24); color: white; padding: 1.5rem; border-radius: 15px; text-align: center;">
-                <h3>❌</h3>
-                <p>AI Setup Needed</p>
-            </div>
-            """, unsafe_allow_html=True)
+            render_ai_status_card(api_key)
     
     st.markdown("---")
     
@@ -731,39 +3181,267 @@ def display_course_dashboard():
     )
     st.plotly_chart(fig, use_container_width=True)
 
-def display_slides():
-    """Display interactive slides with navigation"""
-    st.markdown("# 📚 Course Slides")
+def go_to_slide(index: int) -> None:
+    """Button callback that moves the slide viewer before its fragment reruns"""
+    st.session_state.current_slide = max(0, min(len(get_slides()) - 1, index))
+    follow_current_slide()
+
+def follow_current_slide() -> None:
+    """Reopen the slide overview on the page that holds the current slide"""
+    st.session_state.slide_overview_page = None
+
+def jump_to_slide() -> None:
+    """Jump-to-number callback; the field counts slides from 1"""
+    go_to_slide(st.session_state.slide_jump - 1)
+
+def flip_overview_page(step: int) -> None:
+    """Page the slide overview without moving the current slide"""
+    st.session_state.slide_overview_page += step
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def get_slide_titles(slides_version: str) -> tuple:
+    """Lower-cased slide titles for the overview filter, built once per deck version"""
+    return tuple(slide["title"].lower() for slide in get_slides())
+
+def display_slide_overview(slides: tuple, current: int) -> None:
+    """Filterable, paged slide overview; only one page of buttons is rendered however long the deck"""
+    page_size = int(get_setting("SLIDE_OVERVIEW_PAGE_SIZE", 10))
+    
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        query = st.text_input("Filter by title", key="slide_filter", on_change=follow_current_slide,
+                              placeholder="Example: Detroit")
+    with col2:
+        # Set before the widget exists so it always shows the slide on screen
+        st.session_state.slide_jump = current + 1
+        st.number_input("Jump to slide", min_value=1, max_value=len(slides), step=1,
+                        key="slide_jump", on_change=jump_to_slide)
+    
+    query = query.strip().lower()
+    if query:
+        titles = get_slide_titles(content_version("slides"))
+        matches = [i for i, title in enumerate(titles) if query in title]
+    else:
+        matches = range(len(slides))
+    if not matches:
+        st.caption("No slide titles match that filter.")
+        return
+    
+    pages = math.ceil(len(matches) / page_size)
+    page = st.session_state.get('slide_overview_page')
+    if page is None:
+        page = bisect.bisect_left(matches, current) // page_size
+    page = max(0, min(pages - 1, page))
+    st.session_state.slide_overview_page = page
+    
+    start = page * page_size
+    for i in matches[start:start + page_size]:
+        emoji = "📍" if i == current else "📄"
+        st.button(f"{emoji} {i + 1}. {slides[i]['title']}", key=f"slide_{i}", on_click=go_to_slide, args=(i,))
+    
+    if pages > 1:
+        col1, col2, col3 = st.columns([1, 2, 1])
+        with col1:
+            st.button("◀ Earlier", key="overview_earlier", disabled=(page == 0),
+                      on_click=flip_overview_page, args=(-1,))
+        with col2:
+            end = min(start + page_size, len(matches))
+            st.caption(f"Showing {start + 1}-{end} of {len(matches)} slides")
+        with col3:
+            st.button("Later ▶", key="overview_later", disabled=(page >= pages - 1),
+                      on_click=flip_overview_page, args=(1,))
+
+@st.fragment
+def slide_viewer() -> None:
+    """Slide navigation, the current slide and the overview, rerun on their own"""
+    slides = get_slides()
+    if not slides:
+        st.info("No slides have been published yet.")
+        return
+    # A deck edited down to fewer slides must not leave the student past its end
+    current = min(st.session_state.current_slide, len(slides) - 1)
     
     # Slide navigation
     col1, col2, col3 = st.columns([1, 2, 1])
     
     with col1:
-        if st.button("⬅️ Previous", disabled=(st.session_state.current_slide == 0)):
-            st.session_state.current_slide = max(0, st.session_state.current_slide - 1)
-            st.rerun()
+        st.button("⬅️ Previous", disabled=(current == 0),
+                  on_click=go_to_slide, args=(current - 1,))
     
     with col2:
-        st.markdown(f"<center>Slide {st.session_state.current_slide + 1} of {len(SLIDES)}</center>", 
+        st.markdown(f"<center>Slide {current + 1} of {len(slides)}</center>", 
                    unsafe_allow_html=True)
     
     with col3:
-        if st.button("Next ➡️", disabled=(st.session_state.current_slide >= len(SLIDES) - 1)):
-            st.session_state.current_slide = min(len(SLIDES) - 1, st.session_state.current_slide + 1)
-            st.rerun()
+        st.button("Next ➡️", disabled=(current >= len(slides) - 1),
+                  on_click=go_to_slide, args=(current + 1,))
     
     # Display current slide
-    if 0 <= st.session_state.current_slide < len(SLIDES):
-        create_interactive_slide(SLIDES[st.session_state.current_slide])
+    if 0 <= current < len(slides):
+        create_interactive_slide(slides[current])
     
     # Slide overview
     st.markdown("---")
     st.markdown("### Slide Overview")
-    for i, slide in enumerate(SLIDES):
-        emoji = "📍" if i == st.session_state.current_slide else "📄"
-        if st.button(f"{emoji} {slide['title']}", key=f"slide_{i}"):
-            st.session_state.current_slide = i
-            st.rerun()
+    display_slide_overview(slides, current)
+
+def display_slides():
+    """Display interactive slides with navigation"""
+    st.markdown("# 📚 Course Slides")
+    
+    # Shared stylesheet stays in the full run so slide flips only resend the slide itself
+    inject_slide_css()
+    slide_viewer()
+
+def queue_status_reporter(placeholder) -> Callable[[int, float], None]:
+    """Build an on_wait callback that tells the student where their question stands"""
+    def report(position: int, seconds: float) -> None:
+        if position == 0:
+            placeholder.warning(f"⏳ Michigan State AI is busy - retrying in {seconds:.0f}s...")
+        elif position == 1 and seconds <= 0:
+            placeholder.info("⏳ Your question has been sent to Michigan State AI.")
+        elif position == 1:
+            placeholder.info(f"⏳ You're next - about {seconds:.0f}s until your question is sent.")
+        else:
+            placeholder.info(f"⏳ You're #{position} in line for Michigan State AI.")
+    return report
+
+@st.fragment
+def display_expert_panel(expert_keys: List[str]) -> None:
+    """Ask all Michigan State AI experts the same question at once"""
+    st.markdown("### Ask the Panel")
+    st.markdown("Get the historical, geographic and Detroit perspectives on one question at the same time.")
+    
+    question = st.text_area(
+        "What would you like the panel to discuss?",
+        key="question_panel",
+        placeholder="Example: Why did the automobile industry grow up around Detroit?",
+        height=100
+    )
+    
+    if st.button("Ask all three experts", key="ask_panel"):
+        if question.strip():
+            columns = st.columns(len(expert_keys))
+            placeholders = {}
+            for column, expert_key in zip(columns, expert_keys):
+                with column:
+                    st.markdown(f"#### {get_experts()[expert_key]['name']}")
+                    placeholders[expert_key] = st.empty()
+                    placeholders[expert_key].info("Consulting...")
+            
+            # Each answer is shown and stored the moment its request finishes
+            for expert_key, response in ask_expert_panel(question, expert_keys):
+                placeholders[expert_key].markdown(response)
+                add_conversation({
+                    'expert': get_experts()[expert_key]['name'],
+                    'question': question,
+                    'response': response,
+                    'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                })
+        else:
+            st.warning("Please enter a question.")
+
+@st.fragment(run_every=1)
+def poll_expert_jobs(expert_key: str) -> None:
+    """Show this expert's queued questions, refreshing only this block until they finish"""
+    if collect_finished_jobs():
+        st.rerun()
+    
+    jobs = get_job_queue()
+    for entry in st.session_state.pending_jobs:
+        if entry['expert_key'] != expert_key:
+            continue
+        job = jobs.get(entry['job_id'])
+        name = get_experts()[expert_key]['name']
+        asked = f"*{entry['question'][:60]}*"
+        position, deadline = (job and job['wait']) or (None, 0.0)
+        seconds = deadline - time.time()
+        if not job or job['status'] != 'running':
+            st.info(f"⏳ {name} is waiting in line: {asked}")
+        elif position == 0 and seconds > 0:
+            st.warning(f"⏳ Michigan State AI is busy - retrying in {seconds:.0f}s: {asked}")
+        elif position == 1 and seconds > 0:
+            st.info(f"⏳ You're next - about {seconds:.0f}s until your question is sent: {asked}")
+        elif position is not None and position > 1:
+            st.info(f"⏳ You're #{position} in line for Michigan State AI: {asked}")
+        else:
+            st.info(f"⏳ {name} is thinking: {asked}")
+
+def reset_conversation(expert_key: str) -> None:
+    """Button callback that starts this expert's next question without earlier context"""
+    st.session_state.conversation_resets[expert_key] = get_conversation_store()['next_seq']
+
+@st.fragment
+def expert_chat(expert_key: str) -> None:
+    """One expert's question box, answer and history, rerun on their own while the student types"""
+    expert = get_experts()[expert_key]
+    
+    st.markdown("---")
+    st.markdown("#### Ask a Question")
+    
+    question = st.text_area(
+        "What would you like to know about Michigan history?",
+        key=f"question_{expert_key}",
+        placeholder="Example: How did the Great Lakes influence early settlement patterns?",
+        height=100
+    )
+    
+    stream_answer = st.toggle("Stream answer live (keeps this page busy until it finishes)",
+                              value=False, key=f"stream_{expert_key}")
+    remember = st.toggle("Remember this conversation (follow-up questions)",
+                         value=True, key=f"remember_{expert_key}")
+    reset_seq = st.session_state.conversation_resets.get(expert_key, 0)
+    earlier = count_conversations_since(expert['name'], reset_seq) if remember else 0
+    if earlier:
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            st.caption(f"💬 Follow-up questions continue a conversation of {earlier} earlier question(s)")
+        with col2:
+            st.button("Start new conversation", key=f"reset_{expert_key}",
+                      on_click=reset_conversation, args=(expert_key,))
+    
+    if st.button(f"Ask {expert['name']}", key=f"ask_{expert_key}"):
+        if question.strip():
+            # Standalone questions go without history so the shared answer cache,
+            # near-duplicate matches and pinned FAQ answers still apply to them
+            history = expert_history(expert_key) if earlier and looks_like_follow_up(question) else None
+            if stream_answer:
+                queue_status = st.empty()
+                on_wait = queue_status_reporter(queue_status)
+                st.markdown("#### Response:")
+                response = st.write_stream(
+                    stream_ai_specialist_response(expert_key, question, on_wait=on_wait, history=history)
+                )
+                queue_status.empty()
+                
+                # Store conversation
+                conversation = {
+                    'expert': expert['name'],
+                    'question': question,
+                    'response': response,
+                    'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                }
+                add_conversation(conversation)
+            else:
+                problem = submit_specialist_question(expert_key, question, history)
+                if problem:
+                    st.markdown(problem)
+        else:
+            st.warning("Please enter a question.")
+    
+    if any(job['expert_key'] == expert_key for job in st.session_state.pending_jobs):
+        poll_expert_jobs(expert_key)
+    
+    # Show conversation history for this expert
+    expert_conversations = recent_conversations(expert['name'], 3)
+    
+    if expert_conversations:
+        st.markdown("---")
+        st.markdown("#### Previous Conversations")
+        for conv in expert_conversations:  # Show last 3 conversations
+            with st.expander(f"Q: {conv['question'][:50]}... ({conv['timestamp']})"):
+                st.markdown(f"**Question:** {conv['question']}")
+                st.markdown(f"**Response:** {conv['response']}")
 
 def display_ai_experts():
     """Display Michigan State AI experts interface"""
@@ -771,17 +3449,21 @@ def display_ai_experts():
     st.markdown("Get help from specialized AI historians who understand Michigan's unique story.")
     
     # Expert selection
-    expert_tabs = st.tabs([
+    *expert_tabs, panel_tab = st.tabs([
         "🏛️ Historical Expert", 
         "🗺️ Geography Expert", 
-        "🏙️ Detroit Historian"
+        "🏙️ Detroit Historian",
+        "👥 Ask the Panel"
     ])
     
     expert_keys = ["Historical_Expert", "Geography_Expert", "Detroit_Historian"]
     
+    with panel_tab:
+        display_expert_panel(expert_keys)
+    
     for i, (tab, expert_key) in enumerate(zip(expert_tabs, expert_keys)):
         with tab:
-            expert = MICHIGAN_AI_EXPERTS[expert_key]
+            expert = get_experts()[expert_key]
             
             # Expert profile
             st.markdown(f"### {expert['name']}")
@@ -808,63 +3490,49 @@ def display_ai_experts():
                         st.info("I'll focus on educational content about Michigan history.")
             
             # Chat interface
-            st.markdown("---")
-            st.markdown("#### Ask a Question")
-            
-            question = st.text_area(
-                "What would you like to know about Michigan history?",
-                key=f"question_{expert_key}",
-                placeholder="Example: How did the Great Lakes influence early settlement patterns?",
-                height=100
-            )
-            
-            if st.button(f"Ask {expert['name']}", key=f"ask_{expert_key}"):
-                if question.strip():
-                    with st.spinner(f"Consulting with {expert['name']}..."):
-                        response = get_ai_specialist_response(expert_key, question)
-                        
-                        # Store conversation
-                        conversation = {
-                            'expert': expert['name'],
-                            'question': question,
-                            'response': response,
-                            'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                        }
-                        st.session_state.ai_conversations.append(conversation)
-                        
-                        # Display response
-                        st.markdown("#### Response:")
-                        st.markdown(response)
-                else:
-                    st.warning("Please enter a question.")
-            
-            # Show conversation history for this expert
-            expert_conversations = [
-                conv for conv in st.session_state.ai_conversations 
-                if conv['expert'] == expert['name']
-            ]
-            
-            if expert_conversations:
-                st.markdown("---")
-                st.markdown("#### Previous Conversations")
-                for conv in expert_conversations[-3:]:  # Show last 3 conversations
-                    with st.expander(f"Q: {conv['question'][:50]}... ({conv['timestamp']})"):
-                        st.markdown(f"**Question:** {conv['question']}")
-                        st.markdown(f"**Response:** {conv['response']}")
+            expert_chat(expert_key)
 
-def display_quizzes():
-    """Display interactive quizzes"""
-    st.markdown("# 📝 Knowledge Check Quizzes")
+def submit_quiz(quiz_key: str) -> None:
+    """Button callback that scores a fully answered quiz before its fragment reruns"""
+    quiz = get_quiz_data()[quiz_key]
+    quiz_state = st.session_state.quiz_attempts[quiz_key]
+    if len(quiz_state['answers']) != len(quiz['questions']):
+        return
+    
+    quiz_state['submitted'] = True
     
+    # Calculate score
+    correct_answers = 0
+    for i, question_data in enumerate(quiz['questions']):
+        if quiz_state['answers'].get(i) == question_data['correct']:
+            correct_answers += 1
+    
+    quiz_state['score'] = (correct_answers / len(quiz['questions'])) * 100
+    save_quiz_attempt(quiz_key)
+
+def reset_quiz(quiz_key: str) -> None:
+    """Button callback that clears a quiz attempt so it can be taken again"""
+    st.session_state.quiz_attempts[quiz_key] = {
+        'answers': {},
+        'submitted': False,
+        'score': 0
+    }
+    save_quiz_attempt(quiz_key)
+
+@st.fragment
+def quiz_panel() -> None:
+    """Quiz picker, questions and results, rerun on their own as answers come in"""
     # Quiz selection
-    quiz_options = list(QUIZ_DATA.keys())
+    quizzes = get_quiz_data()
+    quiz_options = list(quizzes.keys())
     selected_quiz = st.selectbox(
         "Choose a quiz:",
         quiz_options,
-        format_func=lambda x: QUIZ_DATA[x]["title"]
+        format_func=lambda x: quizzes[x]["title"],
+        key="selected_quiz"
     )
     
-    quiz = QUIZ_DATA[selected_quiz]
+    quiz = quizzes[selected_quiz]
     st.markdown(f"## {quiz['title']}")
     
     # Initialize quiz attempt if not exists
@@ -891,24 +3559,13 @@ def display_quizzes():
                 index=None
             )
             
-            if answer:
+            if answer and quiz_state['answers'].get(i) != question_data['options'].index(answer):
                 quiz_state['answers'][i] = question_data['options'].index(answer)
+                save_quiz_attempt(selected_quiz)
         
-        # Submit button
-        if st.button("Submit Quiz"):
-            if len(quiz_state['answers']) == len(quiz['questions']):
-                quiz_state['submitted'] = True
-                
-                # Calculate score
-                correct_answers = 0
-                for i, question_data in enumerate(quiz['questions']):
-                    if quiz_state['answers'].get(i) == question_data['correct']:
-                        correct_answers += 1
-                
-                quiz_state['score'] = (correct_answers / len(quiz['questions'])) * 100
-                st.rerun()
-            else:
-                st.warning("Please answer all questions before submitting.")
+        # Submit button; the callback only leaves the quiz open when answers are missing
+        if st.button("Submit Quiz", on_click=submit_quiz, args=(selected_quiz,)):
+            st.warning("Please answer all questions before submitting.")
     
     else:
         # Show results
@@ -940,21 +3597,130 @@ def display_quizzes():
             st.markdown("---")
         
         # Reset button
-        if st.button("Take Quiz Again"):
-            st.session_state.quiz_attempts[selected_quiz] = {
-                'answers': {},
-                'submitted': False,
-                'score': 0
-            }
-            st.rerun()
+        st.button("Take Quiz Again", on_click=reset_quiz, args=(selected_quiz,))
+
+def display_quizzes():
+    """Display interactive quizzes"""
+    st.markdown("# 📝 Knowledge Check Quizzes")
+    quiz_panel()
+
+def is_instructor() -> bool:
+    """True once this session has entered the INSTRUCTOR_PASSWORD"""
+    return st.session_state.get('instructor_authenticated', False)
+
+def display_instructor_admin():
+    """Instructor-only view of Michigan State AI latency, errors and capacity"""
+    st.markdown("# 🛠️ Instructor Admin")
+    
+    if not is_instructor():
+        password = st.text_input("Instructor password", type="password", key="instructor_password")
+        if st.button("Sign in"):
+            # Bytes, so non-ASCII input and numeric secrets compare instead of raising TypeError
+            expected = str(get_setting("INSTRUCTOR_PASSWORD", "")).encode("utf-8")
+            if hmac.compare_digest(password.encode("utf-8"), expected):
+                st.session_state.instructor_authenticated = True
+                st.rerun()
+            else:
+                st.error("❌ Incorrect password")
+        return
+    
+    st.markdown("## Michigan State AI latency by expert")
+    rows = get_ai_metrics().summary()
+    if not rows:
+        st.info("No questions answered since the server started.")
+    else:
+        seconds = lambda value: f"{value:.2f}s" if value is not None else "—"
+        st.dataframe(pd.DataFrame([{
+            "Expert": get_experts().get(row['expert'], {}).get('name', row['expert']),
+            "Calls": row['calls'],
+            "p50": seconds(row['p50']),
+            "p95": seconds(row['p95']),
+            "p99": seconds(row['p99']),
+            "First token p50": seconds(row['ttft_p50']),
+            "First token p95": seconds(row['ttft_p95']),
+            "Error rate": f"{row['error_rate']:.1%}",
+            "Cache hits": f"{row['cache_hit_rate']:.0%}",
+            "Retries": row['retries'],
+            "Avg output tokens": round(row['avg_output_tokens'])
+        } for row in rows]), hide_index=True, use_container_width=True)
+        
+        errors = {row['expert']: row['errors'] for row in rows if row['errors']}
+        if errors:
+            st.markdown("#### Errors by cause")
+            for expert, causes in errors.items():
+                st.markdown(f"**{expert}:** " + ", ".join(f"{cause} × {n}" for cause, n in causes.items()))
+    
+    routed = get_question_router().stats()
+    if routed:
+        st.caption("🧭 Questions by tier: " + ", ".join(
+            f"{tier} {count} ({get_question_router().routes[tier]['model']}, "
+            f"{get_question_router().routes[tier]['max_tokens']} tokens)"
+            for tier, count in sorted(routed.items())
+        ))
+    
+    prompt_stats = get_prompt_cache_stats().stats()
+    if prompt_stats['responses']:
+        st.caption(
+            f"🧠 Prompt cache: {prompt_stats['cached_share']:.0%} of prompt tokens read from cache "
+            f"({prompt_stats['cache_read_input_tokens']:,} read, "
+            f"{prompt_stats['cache_creation_input_tokens']:,} written, "
+            f"{prompt_stats['input_tokens']:,} uncached over {prompt_stats['responses']} responses)"
+        )
+    
+    if hedging_enabled():
+        hedge_stats = get_request_hedger().stats()
+        st.markdown("## Hedged requests")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Hedge rate", f"{hedge_stats['hedge_rate']:.1%}",
+                      help=f"Capped at {get_request_hedger().max_rate:.0%} of recent calls")
+        with col2:
+            st.metric("Hedges won", f"{hedge_stats['hedge_wins']}/{hedge_stats['hedges']}")
+        with col3:
+            if hedge_stats['p99'] is not None and hedge_stats['p99_unhedged'] is not None:
+                st.metric("p99 latency", f"{hedge_stats['p99']:.2f}s",
+                          delta=f"{hedge_stats['p99'] - hedge_stats['p99_unhedged']:+.2f}s vs. unhedged",
+                          delta_color="inverse")
+            else:
+                st.metric("p99 latency", "—")
+    
+    st.markdown("## Capacity")
+    job_stats = get_job_queue().stats()
+    limiter_stats = get_rate_limiter().stats()
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Jobs queued", job_stats['queued'])
+    with col2:
+        st.metric("Workers busy", f"{job_stats['running']}/{job_stats['workers']}")
+    with col3:
+        st.metric("Worker utilization", f"{job_stats['utilization']:.0%}")
+    with col4:
+        st.metric("Rate-limit waits", limiter_stats['queued'])
+    
+    progress_stats = get_progress_store().stats()
+    st.caption(
+        f"🗄️ Progress saves: {progress_stats['written']} rows in {progress_stats['batches']} batches, "
+        f"{progress_stats['coalesced']} superseded, {progress_stats['pending']} pending, "
+        f"{progress_stats['errors']} failed batches"
+    )
+    
+    exporters = start_metrics_exporter()
+    if exporters.get('port'):
+        st.caption(f"📤 Prometheus endpoint: http://{get_setting('METRICS_HOST', '127.0.0.1')}:"
+                   f"{exporters['port']}/metrics")
+    if exporters.get('file'):
+        st.caption(f"📤 Scrape file: {exporters['file']}")
+    with st.expander("Prometheus metrics"):
+        st.code(render_prometheus_metrics(), language="text")
 
 def display_resources():
     """Display course resources"""
     st.markdown("# 📚 Course Resources")
+    resources = get_resources()
     
     # Video resources
     st.markdown("## 🎥 Educational Videos")
-    for video in MICHIGAN_RESOURCES['videos']:
+    for video in resources['videos']:
         with st.expander(f"{video['title']} ({video['duration']})"):
             st.markdown(f"**Topic:** {video['topic']}")
             st.markdown(video['description'])
@@ -962,7 +3728,7 @@ def display_resources():
     
     # Article resources
     st.markdown("## 📖 Articles & Research")
-    for article in MICHIGAN_RESOURCES['articles']:
+    for article in resources['articles']:
         with st.expander(article['title']):
             st.markdown(article['description'])
             st.markdown(f"[Read Article]({article['url']})")
@@ -972,11 +3738,68 @@ def display_resources():
         st.markdown("## 🏠 Michigan Resident Resources")
         st.info("Since you're a Michigan resident, here are some additional helpful resources:")
         
-        for resource in MICHIGAN_RESOURCES['michigan_resident_resources']:
+        for resource in resources['michigan_resident_resources']:
             with st.expander(resource['title']):
                 st.markdown(resource['description'])
                 st.markdown(f"[Visit Site]({resource['url']})")
 
+def open_search_result(page_label: str, **state) -> None:
+    """Result button callback: point the sidebar and the target page at the result"""
+    st.session_state.nav_page = page_label
+    for key, value in state.items():
+        st.session_state[key] = value
+    follow_current_slide()
+
+@st.fragment
+def search_panel() -> None:
+    """Search box and ranked results, rerun on their own while the student searches"""
+    query = st.text_input(
+        "Search slides, quizzes, resources and your Michigan State AI conversations",
+        key="search_query",
+        placeholder="Example: ribbon farms"
+    )
+    if not query.strip():
+        st.caption("Results are ranked by relevance. Only you can see your own conversations.")
+        return
+    
+    started = time.perf_counter()
+    results = search_indexes(
+        [get_course_search_index(course_search_version()), get_conversation_search_index()],
+        query, int(get_setting("SEARCH_RESULTS", 10))
+    )
+    st.caption(f"{len(results)} result(s) in {(time.perf_counter() - started) * 1000:.1f} ms")
+    if not results:
+        st.info("Nothing matched. Try fewer or different words.")
+    
+    for rank, (score, doc) in enumerate(results):
+        st.markdown("---")
+        if doc['kind'] == 'slide':
+            st.markdown(f"📚 **{doc['title']}** · Slide {doc['slide'] + 1}")
+            st.markdown(best_snippet(doc['text'], query))
+            if st.button("Open slide", key=f"search_open_{rank}", on_click=open_search_result,
+                         args=("📚 Course Slides",), kwargs={'current_slide': doc['slide']}):
+                st.rerun()
+        elif doc['kind'] == 'quiz':
+            st.markdown(f"📝 **{doc['title']}**")
+            st.markdown(best_snippet(doc['text'], query))
+            if st.button("Open quiz", key=f"search_open_{rank}", on_click=open_search_result,
+                         args=("📝 Quizzes",), kwargs={'selected_quiz': doc['quiz']}):
+                st.rerun()
+        elif doc['kind'] == 'resource':
+            st.markdown(f"🔗 **[{doc['title']}]({doc['url']})**")
+            st.markdown(best_snippet(doc['text'], query))
+        else:
+            conversation = find_conversation(doc['expert'], doc['seq'])
+            st.markdown(f"💬 **{doc['title']}** · {doc['expert']}")
+            if conversation:
+                st.markdown(best_snippet(f"{conversation['question']}\n{conversation['response']}", query))
+                st.caption(conversation['timestamp'])
+
+def display_search():
+    """Full-text search across the course and this session's conversations"""
+    st.markdown("# 🔍 Search the Course")
+    search_panel()
+
 # Main application
 def main():
     """Main application logic"""
@@ -989,27 +3812,79 @@ def main():
         "📚 Course Slides": "slides", 
         "🤖 Michigan State AI": "ai_experts",
         "📝 Quizzes": "quizzes",
-        "📚 Resources": "resources"
+        "📚 Resources": "resources",
+        "🔍 Search": "search"
     }
+    if get_setting("INSTRUCTOR_PASSWORD"):
+        pages["🛠️ Instructor Admin"] = "admin"
     
-    selected_page = st.sidebar.radio("Go to:", list(pages.keys()))
+    selected_page = st.sidebar.radio("Go to:", list(pages.keys()), key="nav_page")
     st.session_state.current_page = pages[selected_page]
     
+    # Saved progress is restored before this run's pages read it
+    render_progress_controls()
+    
+    # Answers to background questions are delivered on whatever page the student is on
+    collect_finished_jobs()
+    start_metrics_exporter()
+    
     # API Key status in sidebar
     st.sidebar.markdown("---")
     st.sidebar.markdown("### Michigan State AI Status")
     
+    render_api_key_input()
     api_key = get_api_key()
-    if api_key:
-        if st.session_state.api_test_result is None:
+    breaker_stats = get_circuit_breaker().stats()
+    if api_key and breaker_stats['state'] != CircuitBreaker.CLOSED:
+        if breaker_stats['state'] == CircuitBreaker.OPEN:
+            st.sidebar.error(
+                f"⚡ AI unavailable - answering from course materials "
+                f"(retrying in {breaker_stats['retry_in']:.0f}s)"
+            )
+        else:
+            st.sidebar.warning("⚡ AI recovering - checking the connection...")
+    elif api_key:
+        key_status = get_key_validator().peek(api_key)
+        if key_status is None:
             st.sidebar.info("Testing connection...")
-        elif st.session_state.api_test_result[0]:
+        elif key_status[0]:
             st.sidebar.success("✅ AI Ready")
+        elif key_status[0] is None:
+            st.sidebar.warning(f"🌐 {key_status[1]}")
         else:
-            st.sidebar.error(f"❌ {st.session_state.api_test_result[1]}")
+            st.sidebar.error(f"❌ {key_status[1]}")
     else:
         st.sidebar.warning("⚠️ API Key needed")
     
+    conn_stats = get_http_client().stats()
+    if conn_stats['requests']:
+        st.sidebar.caption(
+            f"🔌 Connections reused: {conn_stats['reused']}/{conn_stats['requests']} "
+            f"({conn_stats['reuse_rate']:.0%})"
+        )
+    job_stats = get_job_queue().stats()
+    if job_stats['queued'] or job_stats['running']:
+        st.sidebar.caption(
+            f"🧵 AI jobs: {job_stats['queued']} queued, "
+            f"{job_stats['running']}/{job_stats['workers']} workers busy"
+        )
+    
+    flight_stats = get_singleflight().stats()
+    if flight_stats['coalesced']:
+        st.sidebar.caption(f"🤝 {flight_stats['coalesced']} duplicate API calls saved by sharing")
+    
+    limiter_stats = get_rate_limiter().stats()
+    if limiter_stats['waiting']:
+        st.sidebar.caption(f"🚦 {limiter_stats['waiting']} questions waiting for Michigan State AI")
+    
+    cache_stats = get_answer_cache().stats()
+    if cache_stats['hits'] + cache_stats['misses']:
+        st.sidebar.caption(
+            f"💾 Answer cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+            f"({cache_stats['hit_rate']:.0%}), "
+            f"{get_question_index().stats()['matches']} near-duplicate matches"
+        )
+    
     # Display selected page
     if st.session_state.current_page == "dashboard":
         display_course_dashboard()
@@ -1021,6 +3896,10 @@ def main():
         display_quizzes()
     elif st.session_state.current_page == "resources":
         display_resources()
+    elif st.session_state.current_page == "search":
+        display_search()
+    elif st.session_state.current_page == "admin":
+        display_instructor_admin()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,249 @@
+"""
+Classroom load test for the HIS 220 app
+Wayne County Community College District - HIS 220
+
+Drives many concurrent simulated student sessions through the dashboard,
+slides, quiz, Michigan State AI and resources pages with Streamlit's
+AppTest, against mock_anthropic.py instead of the real API. Reports
+p50/p95/p99 rerun latency per page, error rates, time until AI answers
+land, and memory per session.
+
+Usage:
+    python load_test.py --sessions 30 --latency-median 1.5 --error-429-rate 0.05
+    python load_test.py --sessions 10 --api-url http://127.0.0.1:8765/v1/messages
+
+All sessions share one process, like students on one Streamlit server, so
+the process-wide caches, rate limiter and job queue are exercised for real.
+"""
+
+import argparse
+import logging
+import os
+import pickle
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import List
+
+import streamlit  # noqa: F401  (configure logging before any app run)
+from streamlit.testing.v1 import AppTest
+
+from mock_anthropic import MockAnthropicServer, MockSettings
+
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+for _name in list(logging.root.manager.loggerDict):
+    if _name.startswith("streamlit"):
+        logging.getLogger(_name).setLevel(logging.ERROR)
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+ERROR_MARKERS = ("🔑", "❌", "⏰", "🌐", "🚫", "📖")
+QUESTIONS = [
+    "Who founded Detroit?",
+    "How did the Great Lakes shape settlement?",
+    "What were ribbon farms?",
+    "Why did the auto industry grow in Detroit?",
+    "What was the Three Fires Confederacy?",
+    "How did the fur trade work under French rule?",
+    "Why was the Mackinac Bridge important?",
+    "What caused the Great Migration to Detroit?",
+    "How did iron ore mining change the Upper Peninsula?",
+    "When did Michigan become a state?"
+]
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+class SessionResult:
+    def __init__(self):
+        self.reruns = defaultdict(list)
+        self.run_waits = []
+        self.exceptions = 0
+        self.ai_answers = 0
+        self.ai_errors = 0
+        self.ai_latencies = []
+        self.state_bytes = 0
+        self.failed = None
+
+# AppTest swaps process globals (the mock Runtime, st.secrets) for each run, so
+# script runs are serialized. Background work - API calls, job workers, key
+# checks - still overlaps freely, and time spent waiting for a turn is
+# reported separately from the rerun itself.
+RUN_LOCK = threading.Lock()
+
+def timed_run(at: AppTest, result: SessionResult, page: str) -> AppTest:
+    """Run one rerun and record its latency under the page name"""
+    queued = time.perf_counter()
+    with RUN_LOCK:
+        started = time.perf_counter()
+        at.run()
+        result.reruns[page].append(time.perf_counter() - started)
+    result.run_waits.append(started - queued)
+    if at.exception:
+        result.exceptions += 1
+    return at
+
+def click(at: AppTest, label: str):
+    """Click the first button with this label"""
+    return next(b for b in at.button if b.label == label).click()
+
+def goto(at: AppTest, result: SessionResult, page_label: str, page: str) -> None:
+    at.sidebar.radio[0].set_value(page_label)
+    timed_run(at, result, page)
+
+def simulate_student(result: SessionResult, answer_timeout: float, think_time: float) -> None:
+    """One student's visit: dashboard, slides, quiz, an expert question, resources"""
+    at = AppTest.from_file(APP_PATH, default_timeout=120)
+    pause = lambda: time.sleep(random.uniform(0, think_time))
+
+    timed_run(at, result, "dashboard")
+    click(at, "Start saving my progress")
+    timed_run(at, result, "dashboard")
+    pause()
+
+    goto(at, result, "📚 Course Slides", "slides")
+    for _ in range(3):
+        click(at, "Next ➡️")
+        timed_run(at, result, "slides")
+        pause()
+
+    goto(at, result, "📝 Quizzes", "quizzes")
+    for radio in at.main.radio:
+        radio.set_value(random.choice(radio.options))
+        timed_run(at, result, "quizzes")
+    click(at, "Submit Quiz")
+    timed_run(at, result, "quizzes")
+    pause()
+
+    goto(at, result, "🤖 Michigan State AI", "ai_experts")
+    expert_key = random.choice(["Historical_Expert", "Geography_Expert", "Detroit_Historian"])
+    at.text_area(key=f"question_{expert_key}").input(random.choice(QUESTIONS))
+    at.button(key=f"ask_{expert_key}").click()
+    asked = time.perf_counter()
+    timed_run(at, result, "ai_experts")
+    # The real UI polls with a fragment; here each poll is a full rerun
+    while at.session_state.pending_jobs and time.perf_counter() - asked < answer_timeout:
+        time.sleep(0.25)
+        timed_run(at, result, "ai_poll")
+    if not at.session_state.pending_jobs:
+        result.ai_latencies.append(time.perf_counter() - asked)
+    store = at.session_state.ai_conversations
+    for conversation in (turn for expert in store['experts'].values()
+                         for turn in expert['spill'] + expert['recent']):
+        result.ai_answers += 1
+        if conversation['response'].lstrip().startswith(ERROR_MARKERS):
+            result.ai_errors += 1
+
+    goto(at, result, "📚 Resources", "resources")
+
+    state = {}
+    for key, value in at.session_state.items():
+        try:
+            pickle.dumps(value)
+        except Exception:
+            continue
+        state[key] = value
+    result.state_bytes = len(pickle.dumps(state))
+
+def run_session(result: SessionResult, answer_timeout: float, think_time: float) -> None:
+    try:
+        simulate_student(result, answer_timeout, think_time)
+    except Exception as e:
+        result.failed = f"{type(e).__name__}: {e}"
+
+def report(results: List[SessionResult], elapsed: float, rss_growth_kb: int, mock: MockAnthropicServer) -> None:
+    by_page = defaultdict(list)
+    for result in results:
+        for page, latencies in result.reruns.items():
+            by_page[page].extend(latencies)
+    all_reruns = [latency for latencies in by_page.values() for latency in latencies]
+
+    print(f"\n{len(results)} sessions in {elapsed:.1f}s")
+    print(f"{'page':<12} {'reruns':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for page in sorted(by_page) + ["ALL"]:
+        values = all_reruns if page == "ALL" else by_page[page]
+        print(f"{page:<12} {len(values):>7} {percentile(values, 50) * 1000:>8.0f} "
+              f"{percentile(values, 95) * 1000:>8.0f} {percentile(values, 99) * 1000:>8.0f}")
+
+    failed = [r.failed for r in results if r.failed]
+    exceptions = sum(r.exceptions for r in results)
+    answers = sum(r.ai_answers for r in results)
+    ai_errors = sum(r.ai_errors for r in results)
+    ai_latencies = [latency for r in results for latency in r.ai_latencies]
+    print(f"\nsessions failed:     {len(failed)}/{len(results)}")
+    for reason in sorted(set(failed))[:5]:
+        print(f"    {reason}")
+    waits = [wait for r in results for wait in r.run_waits]
+    print(f"waiting for a turn:  p50 {percentile(waits, 50) * 1000:.0f}ms  p95 {percentile(waits, 95) * 1000:.0f}ms")
+    print(f"rerun exceptions:    {exceptions}/{len(all_reruns)} ({exceptions / max(len(all_reruns), 1):.1%})")
+    print(f"AI error answers:    {ai_errors}/{answers} ({ai_errors / max(answers, 1):.1%})")
+    print(f"AI answer landed:    p50 {percentile(ai_latencies, 50):.2f}s  p95 {percentile(ai_latencies, 95):.2f}s  "
+          f"p99 {percentile(ai_latencies, 99):.2f}s")
+    state_sizes = [r.state_bytes for r in results if r.state_bytes]
+    print(f"session state:       avg {sum(state_sizes) / max(len(state_sizes), 1) / 1024:.1f} KiB (pickled)")
+    print(f"process RSS growth:  {rss_growth_kb / 1024:.1f} MiB total, "
+          f"{rss_growth_kb / max(len(results), 1):.0f} KiB per session")
+    if mock:
+        print(f"mock API:            {mock.stats()}")
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Concurrent-student load test for app.py")
+    parser.add_argument("--sessions", type=int, default=20, help="simulated students")
+    parser.add_argument("--concurrency", type=int, default=None, help="sessions active at once (default: all)")
+    parser.add_argument("--think-time", type=float, default=0.5, help="max random pause between actions (s)")
+    parser.add_argument("--answer-timeout", type=float, default=60, help="give up waiting for an AI answer (s)")
+    parser.add_argument("--api-url", default=None, help="use an already running mock instead of starting one")
+    parser.add_argument("--latency-median", type=float, default=1.0)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--error-429-rate", type=float, default=0.0)
+    parser.add_argument("--error-500-rate", type=float, default=0.0)
+    parser.add_argument("--keep-cache", action="store_true",
+                        help="use the app's real answer cache and progress database instead of throwaway ones")
+    args = parser.parse_args(argv)
+
+    mock = None
+    if args.api_url is None:
+        mock = MockAnthropicServer(MockSettings(
+            latency_median=args.latency_median, latency_sigma=args.latency_sigma,
+            error_429_rate=args.error_429_rate, error_500_rate=args.error_500_rate,
+            retry_after=0.5
+        )).start()
+    # get_setting() falls back to the environment, so this configures every session
+    os.environ["ANTHROPIC_API_URL"] = args.api_url or mock.url
+    os.environ.setdefault("ANTHROPIC_API_KEY", "sk-ant-load-test")
+    if not args.keep_cache:
+        scratch = tempfile.mkdtemp(prefix="his220-load-")
+        os.environ["ANSWER_CACHE_PATH"] = os.path.join(scratch, "answers.sqlite3")
+        os.environ["PROGRESS_DB_PATH"] = os.path.join(scratch, "progress.sqlite3")
+
+    results = [SessionResult() for _ in range(args.sessions)]
+    slots = threading.Semaphore(args.concurrency or args.sessions)
+
+    def worker(result: SessionResult) -> None:
+        with slots:
+            run_session(result, args.answer_timeout, args.think_time)
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(r,), name=f"student-{i}") for i, r in enumerate(results)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+
+    report(results, elapsed, rss_growth, mock)
+    if mock:
+        mock.stop()
+    return 1 if any(r.failed for r in results) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
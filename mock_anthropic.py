@@ -0,0 +1,229 @@
+"""
+Local stand-in for the Anthropic Messages API
+Wayne County Community College District - HIS 220
+
+Serves POST /v1/messages with configurable latency and injected 429/500
+errors, in both plain JSON and server-sent-events streaming mode, so the
+app and load_test.py can be exercised without spending API credits.
+
+Usage:
+    python mock_anthropic.py --port 8765 --latency-median 1.5 --error-429-rate 0.05
+    ANTHROPIC_API_URL=http://127.0.0.1:8765/v1/messages streamlit run app.py
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+LOREM = (
+    "Detroit was founded in 1701 by Antoine de la Mothe Cadillac as Fort Pontchartrain du Detroit, "
+    "a French trading post on the strait between Lake Erie and Lake Huron. Its ribbon farms stretched "
+    "back from the river so every family had water access, and the Great Lakes made the region a "
+    "crossroads for the fur trade, later for lumber and iron, and eventually for the automobile industry."
+).split()
+
+class MockSettings:
+    """Behaviour knobs for the mock server (latencies in seconds)"""
+
+    def __init__(self, latency_median: float = 1.0, latency_sigma: float = 0.5,
+                 first_token_fraction: float = 0.2, error_429_rate: float = 0.0,
+                 error_500_rate: float = 0.0, retry_after: float = 1.0,
+                 output_tokens: int = 120, invalid_key: Optional[str] = "sk-invalid"):
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.first_token_fraction = first_token_fraction
+        self.error_429_rate = error_429_rate
+        self.error_500_rate = error_500_rate
+        self.retry_after = retry_after
+        self.output_tokens = output_tokens
+        self.invalid_key = invalid_key
+
+    def sample_latency(self) -> float:
+        """Log-normal total latency around the configured median"""
+        if self.latency_median <= 0:
+            return 0.0
+        return random.lognormvariate(0, self.latency_sigma) * self.latency_median
+
+class MockAnthropicHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    settings = MockSettings()
+    stats = {'requests': 0, 'streams': 0, '429': 0, '500': 0, '401': 0}
+    stats_lock = threading.Lock()
+    cached_prefixes = set()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _count(self, name: str) -> None:
+        with self.stats_lock:
+            self.stats[name] += 1
+
+    def _send_json(self, status: int, body: dict, headers: Optional[dict] = None) -> None:
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _error(self, status: int, error_type: str, message: str, headers: Optional[dict] = None) -> None:
+        self._send_json(status, {"type": "error", "error": {"type": error_type, "message": message}}, headers)
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/v1/messages":
+            self._error(404, "not_found_error", f"Unknown path {self.path}")
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        self._count('requests')
+        settings = self.settings
+
+        if self.headers.get("x-api-key") == settings.invalid_key:
+            self._count('401')
+            self._error(401, "authentication_error", "invalid x-api-key")
+            return
+        roll = random.random()
+        if roll < settings.error_429_rate:
+            self._count('429')
+            self._error(429, "rate_limit_error", "Number of requests has exceeded your rate limit",
+                        {"retry-after": str(settings.retry_after)})
+            return
+        if roll < settings.error_429_rate + settings.error_500_rate:
+            self._count('500')
+            self._error(500, "api_error", "Internal server error")
+            return
+
+        words = min(body.get("max_tokens", settings.output_tokens), settings.output_tokens)
+        text_words = [LOREM[i % len(LOREM)] for i in range(words)]
+        usage = self._usage(body, words)
+        message = {
+            "id": f"msg_mock_{uuid.uuid4().hex[:12]}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "mock"),
+            "stop_reason": "end_turn",
+        }
+        latency = settings.sample_latency()
+
+        if body.get("stream"):
+            self._count('streams')
+            self._stream(message, text_words, usage, latency)
+        else:
+            time.sleep(latency)
+            self._send_json(200, dict(message, content=[{"type": "text", "text": " ".join(text_words)}],
+                                      usage=usage))
+
+    def _usage(self, body: dict, output_tokens: int) -> dict:
+        """Token usage, mimicking prompt caching for system blocks marked with cache_control"""
+        system = body.get("system", "")
+        messages_tokens = len(json.dumps(body.get("messages", []))) // 4
+        if not isinstance(system, list) or not any("cache_control" in block for block in system):
+            return {"input_tokens": len(json.dumps(system)) // 4 + messages_tokens,
+                    "output_tokens": output_tokens}
+        prefix = json.dumps(system, sort_keys=True)
+        prefix_tokens = len(prefix) // 4
+        with self.stats_lock:
+            hit = prefix in self.cached_prefixes
+            self.cached_prefixes.add(prefix)
+        return {
+            "input_tokens": messages_tokens,
+            "output_tokens": output_tokens,
+            "cache_read_input_tokens": prefix_tokens if hit else 0,
+            "cache_creation_input_tokens": 0 if hit else prefix_tokens
+        }
+
+    def _stream(self, message: dict, words: list, usage: dict, latency: float) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        def event(name: str, data: dict) -> None:
+            self.wfile.write(f"event: {name}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        time.sleep(latency * self.settings.first_token_fraction)
+        event("message_start", {"type": "message_start",
+                                "message": dict(message, content=[], usage=dict(usage, output_tokens=1))})
+        event("content_block_start", {"type": "content_block_start", "index": 0,
+                                      "content_block": {"type": "text", "text": ""}})
+        per_token = latency * (1 - self.settings.first_token_fraction) / max(len(words), 1)
+        for i, word in enumerate(words):
+            event("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                          "delta": {"type": "text_delta", "text": word if i == 0 else " " + word}})
+            time.sleep(per_token)
+        event("content_block_stop", {"type": "content_block_stop", "index": 0})
+        event("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn"},
+                                "usage": {"output_tokens": usage["output_tokens"]}})
+        event("message_stop", {"type": "message_stop"})
+        self.close_connection = True
+
+class MockAnthropicServer:
+    """Run the mock API on a background thread (port 0 picks a free port)"""
+
+    def __init__(self, settings: Optional[MockSettings] = None, host: str = "127.0.0.1", port: int = 0):
+        handler = type("Handler", (MockAnthropicHandler,), {
+            'settings': settings or MockSettings(),
+            'stats': dict(MockAnthropicHandler.stats),
+            'stats_lock': threading.Lock(),
+            'cached_prefixes': set()
+        })
+        self.handler = handler
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1/messages"
+
+    def stats(self) -> dict:
+        with self.handler.stats_lock:
+            return dict(self.handler.stats)
+
+    def start(self) -> "MockAnthropicServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="mock-anthropic", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mock of the Anthropic Messages API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-median", type=float, default=1.0, help="median response time in seconds")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="log-normal spread of response time")
+    parser.add_argument("--first-token-fraction", type=float, default=0.2,
+                        help="share of the latency spent before the first streamed token")
+    parser.add_argument("--error-429-rate", type=float, default=0.0)
+    parser.add_argument("--error-500-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0, help="retry-after seconds sent with 429s")
+    parser.add_argument("--output-tokens", type=int, default=120)
+    args = parser.parse_args()
+
+    settings = MockSettings(
+        latency_median=args.latency_median, latency_sigma=args.latency_sigma,
+        first_token_fraction=args.first_token_fraction, error_429_rate=args.error_429_rate,
+        error_500_rate=args.error_500_rate, retry_after=args.retry_after,
+        output_tokens=args.output_tokens
+    )
+    server = MockAnthropicServer(settings, args.host, args.port)
+    print(f"Mock Anthropic API listening on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
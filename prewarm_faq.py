@@ -0,0 +1,162 @@
+"""
+Pre-generate Michigan State AI answers for a course FAQ
+Wayne County Community College District - HIS 220
+
+Reads a question file, asks each expert through the same request path the
+app uses (prompt construction, rate limiting, retries) and pins the
+answers in the shared answer cache, so early-semester questions are served
+without a live API call. Pinned answers ignore ANSWER_CACHE_TTL_SECONDS and
+the ANSWER_CACHE_MAX_ENTRIES eviction. Progress is checkpointed so an interrupted run can
+be resumed by running the same command again.
+
+Usage:
+    python prewarm_faq.py questions.jsonl --workers 4
+    python prewarm_faq.py questions.txt --experts Detroit_Historian --resident no
+
+Question files are either plain text (one question per line, asked of every
+selected expert) or JSON Lines with objects such as:
+    {"question": "What were ribbon farms?", "experts": ["Detroit_Historian"], "slide": "detroit_founding"}
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List
+
+import streamlit  # noqa: F401  (configure logging before app.py runs in bare mode)
+
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+for _name in list(logging.root.manager.loggerDict):
+    if _name.startswith("streamlit"):
+        logging.getLogger(_name).setLevel(logging.ERROR)
+
+import app  # noqa: E402
+def load_questions(path: str, experts: List[str], residents: List[bool]) -> List[Dict]:
+    """Expand a question file into one work item per (expert, question, resident flag)"""
+    items = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if path.endswith(".jsonl"):
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise SystemExit(f"{path}:{line_number}: invalid JSON ({e})")
+            else:
+                entry = {"question": line}
+
+            entry_experts = entry.get("experts") or experts
+            unknown = [e for e in entry_experts if e not in app.get_experts()]
+            if unknown:
+                raise SystemExit(f"{path}:{line_number}: unknown expert(s) {', '.join(unknown)}")
+            entry_residents = [entry["resident"]] if "resident" in entry else residents
+
+            for expert in entry_experts:
+                if expert not in experts:
+                    continue
+                for resident in entry_residents:
+                    items.append({
+                        "expert": expert,
+                        "question": entry["question"],
+                        "resident": bool(resident),
+                        "slide": entry.get("slide")
+                    })
+    return items
+
+def item_key(item: Dict) -> str:
+    """Checkpoint identity of a work item"""
+    return "|".join([item["expert"], app.normalize_question(item["question"]), str(int(item["resident"]))])
+
+def load_checkpoint(path: str) -> set:
+    """Keys of items already answered in a previous run"""
+    done = set()
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # a torn last line from an interrupted run
+                if record.get("status") == "done":
+                    done.add(record["key"])
+    return done
+
+def answer_item(api_key: str, item: Dict) -> Dict:
+    """Ask one expert one question and pin the answer in the cache under its exact wording.
+    
+    The near-duplicate index is skipped: a curated question always gets its own
+    answer from the model unless that exact wording is already cached.
+    """
+    expert, question, resident = item["expert"], item["question"], item["resident"]
+    data = app.build_specialist_request(expert, question, resident)
+    response = app.get_answer_cache().get(expert, question, resident, data["model"])
+    if response is None:
+        response = app.request_specialist_answer(api_key, expert, question, resident, data, use_cache=False)
+    stored = None if app.is_error_response(response) else response
+    if stored is not None:
+        app.store_answer(expert, question, resident, data["model"], stored, pinned=True)
+    return {
+        "key": item_key(item),
+        "expert": item["expert"],
+        "question": item["question"],
+        "resident": item["resident"],
+        "slide": item["slide"],
+        "status": "done" if stored is not None else "failed",
+        "error": None if stored is not None else response
+    }
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Pre-generate Michigan State AI answers for a course FAQ")
+    parser.add_argument("questions", help="question file (.txt one per line, or .jsonl)")
+    parser.add_argument("--experts", nargs="+", default=list(app.get_experts()),
+                        choices=list(app.get_experts()), help="experts to ask (default: all)")
+    parser.add_argument("--resident", choices=["no", "yes", "both"], default="both",
+                        help="answer for non-residents, verified residents, or both (default: both)")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent requests (default: 4)")
+    parser.add_argument("--checkpoint", default=os.path.join(app.DATA_DIR, "faq_checkpoint.jsonl"),
+                        help="progress file used to resume interrupted runs")
+    parser.add_argument("--api-key", default=None, help="Anthropic API key (default: ANTHROPIC_API_KEY)")
+    args = parser.parse_args(argv)
+
+    api_key = args.api_key or app.get_setting("ANTHROPIC_API_KEY")
+    if not api_key:
+        parser.error("no API key: pass --api-key or set ANTHROPIC_API_KEY")
+
+    residents = {"no": [False], "yes": [True], "both": [False, True]}[args.resident]
+    items = load_questions(args.questions, args.experts, residents)
+    done = load_checkpoint(args.checkpoint)
+    todo = [item for item in items if item_key(item) not in done]
+    print(f"{len(items)} questions, {len(items) - len(todo)} already answered, {len(todo)} to go")
+    if not todo:
+        return 0
+
+    working, message = app.get_key_validator().validate(api_key)
+    if working is False:
+        print(f"API key check failed: {message}", file=sys.stderr)
+        return 1
+    if working is None:
+        print(f"API key not verified ({message}); continuing", file=sys.stderr)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.checkpoint)), exist_ok=True)
+    failures = 0
+    with open(args.checkpoint, "a", encoding="utf-8") as checkpoint, \
+            ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(answer_item, api_key, item) for item in todo]
+        for n, future in enumerate(as_completed(futures), 1):
+            record = future.result()
+            checkpoint.write(json.dumps(record) + "\n")
+            checkpoint.flush()
+            if record["status"] != "done":
+                failures += 1
+            print(f"[{n}/{len(todo)}] {record['status']:6} {record['expert']}: {record['question'][:60]}")
+
+    print(f"Finished: {len(todo) - failures} answered, {failures} failed (rerun to retry failures)")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())